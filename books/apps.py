@@ -1,5 +1,13 @@
-from django.apps import AppConfig
-
-
-class BooksConfig(AppConfig):
-    name = 'books'
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
+
+
+class BooksConfig(AppConfig):
+    name = "books"
+
+    def ready(self):
+        import books.cache  # noqa: F401
+        from books.search import drop_triggers, install_triggers
+
+        pre_migrate.connect(drop_triggers, sender=self)
+        post_migrate.connect(install_triggers, sender=self)
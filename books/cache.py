@@ -0,0 +1,130 @@
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from books.signals import books_changed
+from core import routers
+
+VERSION_KEY = "books:version"
+CHANGED_KEY = "books:changed_at"
+
+# Per-process counters, see BookCacheStats
+stats = Counter(hits=0, misses=0)
+
+
+def get_cache():
+    return caches[settings.BOOKS_CACHE_ALIAS]
+
+
+def get_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost counter never points back at entries written before it was lost
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_changed_at():
+    return get_cache().get(CHANGED_KEY)
+
+
+# Whether this request may use the cache: a client pinned to the primary after its own write must not be
+# served an entry filled from a replica that had not caught up yet
+def is_usable():
+    return not routers.is_pinned()
+
+
+def get_timeout():
+    # A replica may lag behind the version the entry is stored under, so its entries only live for the pin window
+    return settings.DATABASE_REPLICA_PIN_SECONDS if routers.read_from_replica() else settings.BOOKS_CACHE_TIMEOUT
+
+
+def book_key(version, pk):
+    return f"books:{version}:book:{pk}"
+
+
+# Per-book entries (representation, version, updated_at) for ?ids= reads. The caller reads the catalog version
+# once, before reading the database, so nothing it fetched can be stored under a newer version.
+def get_books(version, ids):
+    keys = {book_key(version, pk): pk for pk in ids}
+    return {keys[key]: entry for key, entry in get_cache().get_many(keys).items()}
+
+
+def set_books(version, entries):
+    get_cache().set_many({book_key(version, pk): entry for pk, entry in entries.items()}, get_timeout())
+
+
+@receiver(books_changed)
+def invalidate(**kwargs):
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_version()
+    # Last-Modified of list responses, whose rows may change by deletion as well
+    cache.set(CHANGED_KEY, int(time.time()), timeout=None)
+
+
+# Caches rendered JSON GET responses under the current catalog version, one rebuild per key at a time.
+# Validators are cached along, so a conditional GET for a cached response needs no query at all.
+class CachedResponseMixin:
+    def get(self, request, *args, **kwargs):
+        # Imported here: BooksConfig.ready loads this module for the signal receiver, and a worker started with
+        # DJANGO_FAST_BOOT must not load DRF along with it
+        from rest_framework import status
+
+        from books import conditional
+
+        if request.accepted_renderer.format != "json" or not is_usable():
+            return super().get(request, *args, **kwargs)
+
+        cache = get_cache()
+        path = hashlib.md5(request.get_full_path().encode("utf-8")).hexdigest()
+        key = f"books:{get_version()}:{self.__class__.__name__}:{path}"
+
+        cached = cache.get(key)
+        locked = False
+        if cached is None:
+            locked = cache.add(f"{key}:lock", 1, timeout=settings.BOOKS_CACHE_LOCK_TIMEOUT)
+            if not locked:
+                cached = self.wait_for(cache, key)
+
+        if cached is not None:
+            stats["hits"] += 1
+            content, content_type, etag, last_modified = cached
+            response = conditional.evaluate(request, etag, last_modified)
+            if response is None:
+                response = HttpResponse(content, content_type=content_type)
+            return conditional.set_validators(response, etag, last_modified)
+
+        stats["misses"] += 1
+        try:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response.accepted_renderer = request.accepted_renderer
+                response.accepted_media_type = request.accepted_media_type
+                response.renderer_context = self.get_renderer_context()
+                response.render()
+                entry = (response.content, response["Content-Type"], *response.validators)
+                cache.set(key, entry, get_timeout())
+        finally:
+            if locked:
+                cache.delete(f"{key}:lock")
+        return response
+
+    def wait_for(self, cache, key):
+        # Another request is rebuilding this key; fall back to our own rebuild if it takes too long
+        deadline = time.monotonic() + settings.BOOKS_CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        return None
@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+
+from books import cache
+from books.models import Book, BookChange
+from books.serializers import COLUMNS, BookSerializer
+
+
+# Changes after the cursor `since`, in log order. A book changed several times within the page is reported
+# once, at its last change, as it is now; one deleted since is reported as deleted.
+def get_changes(since, limit):
+    changes = list(
+        BookChange.objects.filter(id__gt=since).order_by("id").values_list("id", "book_id", "action")[:limit + 1]
+    )
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    latest = {}
+    for change_id, book_id, action in changes:
+        latest.pop(book_id, None)
+        latest[book_id] = (change_id, action)
+
+    fields = list(BookSerializer.Meta.fields)
+    columns = [COLUMNS.get(name, name) for name in fields]
+    alive = [book_id for book_id, (_, action) in latest.items() if action != BookChange.Action.DELETED]
+    books = {
+        row["id"]: {field: row[column] for field, column in zip(fields, columns)}
+        for row in Book.objects.filter(id__in=alive).values(*columns)
+    }
+
+    items = []
+    for book_id, (change_id, action) in latest.items():
+        book = books.get(book_id)
+        items.append({
+            "change": change_id,
+            "action": action if book is not None else BookChange.Action.DELETED,
+            "id": book_id,
+            "book": book,
+        })
+    return items, changes[-1][0] if changes else since, more
+
+
+# Tells whether there are changes after `since`. The log is only queried when the catalog version (shared
+# through the cache and bumped after every commit that changed books) has moved since the last check.
+class ChangeWatch:
+    def __init__(self, since):
+        self.since = since
+        self.version = None
+
+    def check(self):
+        version = cache.get_version()
+        if version == self.version:
+            return False
+        self.version = version
+        return BookChange.objects.filter(id__gt=self.since).exists()
+
+
+def wait_for_changes(since, timeout):
+    deadline = time.monotonic() + timeout
+    watch = ChangeWatch(since)
+    while not watch.check():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(settings.BOOKS_CHANGES_POLL_INTERVAL, remaining))
+    return True
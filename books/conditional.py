@@ -0,0 +1,41 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+VERSION_FIELDS = ["version", "updated_at"]
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = "Книга была изменена, условие запроса не выполнено."
+    default_code = "precondition_failed"
+
+
+def pop_versions(rows):
+    # Rows are fetched with VERSION_FIELDS for the validators only, they are not part of the body
+    return [(row["id"], row.pop("version"), row.pop("updated_at")) for row in rows]
+
+
+# Strong ETag from row metadata: changes with the representation (format and query) and with every write
+def make_etag(request, versions):
+    digest = hashlib.md5(f"{request.accepted_renderer.format}:{request.get_full_path()}".encode("utf-8"))
+    for pk, version, updated_at in versions:
+        digest.update(f"{pk}:{version}:{updated_at.isoformat()}\n".encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+
+# 304 for a fresh GET, 412 for a failed If-Match or If-Unmodified-Since, None to carry on
+def evaluate(request, etag, last_modified):
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    # Kept on the response as well for CachedResponseMixin
+    response.validators = (etag, last_modified)
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
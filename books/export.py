@@ -0,0 +1,48 @@
+import csv
+import zlib
+
+from django.conf import settings
+
+from books.models import Book
+from books.renderers import FIELDS, NDJSONRenderer
+from books.serializers import COLUMNS
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield NDJSONRenderer.render_row(dict(zip(FIELDS, row)))
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def export_books(fmt, compress=False):
+    columns = [COLUMNS.get(field, field) for field in FIELDS]
+    rows = Book.objects.order_by("id").values_list(*columns).iterator(chunk_size=settings.BOOKS_EXPORT_CHUNK_SIZE)
+    lines = csv_lines(rows) if fmt == "csv" else ndjson_lines(rows)
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+    # One write per chunk instead of per row keeps the WSGI overhead down
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= settings.BOOKS_EXPORT_CHUNK_SIZE:
+            yield encode(buffer, compressor)
+            buffer = []
+    yield encode(buffer, compressor)
+    if compressor:
+        yield compressor.flush()
+
+
+def encode(lines, compressor):
+    chunk = "".join(lines).encode("utf-8")
+    return compressor.compress(chunk) if compressor else chunk
@@ -0,0 +1,59 @@
+import sys
+
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from books.search import search_books
+
+
+# ?q= full-text search; ranked results replace any ?ordering=
+class BookSearchFilter(BaseFilterBackend):
+    search_param = "q"
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param)
+        if query is None:
+            return queryset
+        return search_books(queryset, query)
+
+
+# Only lookups an index on author or title can answer; other parameters are ignored
+class BookFieldFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        author = request.query_params.get("author")
+        if author is not None:
+            queryset = queryset.filter(author__name=author)
+
+        prefix = request.query_params.get("title__startswith")
+        if prefix:
+            # startswith compiles to LIKE ... ESCAPE, which SQLite never answers from an index; the range does
+            queryset = queryset.filter(title__gte=prefix, title__startswith=prefix)
+            upper = prefix_upper_bound(prefix)
+            if upper is not None:
+                queryset = queryset.filter(title__lt=upper)
+        return queryset
+
+
+# Smallest string above every string starting with prefix, None if there is none (a prefix of U+10FFFF only)
+def prefix_upper_bound(prefix):
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    last = ord(prefix[-1]) + 1
+    # Surrogates can't be encoded for the database; the next code point in UTF-8 order is U+E000
+    if 0xD800 <= last <= 0xDFFF:
+        last = 0xE000
+    return prefix[:-1] + chr(last)
+
+
+# Ties are broken by id in the same direction, so pages are stable and the index order can be used as is.
+# Public names map to lookups through the view's ordering_columns, e.g. author to author__name.
+class StableOrderingFilter(OrderingFilter):
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and ordering[-1].lstrip("-") != "id":
+            ordering = [*ordering, "-id" if ordering[-1].startswith("-") else "id"]
+        columns = getattr(view, "ordering_columns", {})
+        return [
+            ("-" if name.startswith("-") else "") + columns.get(name.lstrip("-"), name.lstrip("-"))
+            for name in ordering or []
+        ] or ordering
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# Triggers keeping books_fts in sync are installed by books.search.install_triggers after migrate
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("CREATE VIRTUAL TABLE books_fts USING fts5(author, title, tokenize='unicode61')")
+        schema_editor.execute("INSERT INTO books_fts(rowid, author, title) SELECT id, author, title FROM books_book")
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX books_book_search_idx ON books_book "
+            "USING GIN (to_tsvector('simple', books_book.author || ' ' || books_book.title))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for trigger in ["books_fts_insert", "books_fts_update", "books_fts_delete"]:
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        schema_editor.execute("DROP TABLE books_fts")
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS books_book_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
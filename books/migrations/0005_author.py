@@ -0,0 +1,158 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def create_authors(apps, schema_editor):
+    Author = apps.get_model("books", "Author")
+    Book = apps.get_model("books", "Book")
+    db = schema_editor.connection.alias
+
+    # One author per distinct name, with the counts the application maintains from now on
+    counts = Book.objects.using(db).order_by().values_list("author").annotate(books=Count("id"))
+    Author.objects.using(db).bulk_create(
+        (Author(name=name, book_count=books) for name, books in counts.iterator()), batch_size=1000
+    )
+    Book.objects.using(db).update(
+        author_ref=Subquery(Author.objects.using(db).filter(name=OuterRef("author")).values("id")[:1])
+    )
+
+
+def restore_names(apps, schema_editor):
+    Author = apps.get_model("books", "Author")
+    Book = apps.get_model("books", "Book")
+    db = schema_editor.connection.alias
+
+    Book.objects.using(db).update(
+        author=Subquery(Author.objects.using(db).filter(id=OuterRef("author_ref")).values("name")[:1])
+    )
+
+
+# PostgreSQL only. The GIN index of 0002 is an expression over books_book.author, which this migration drops;
+# the name now lives in books_author, out of reach of an expression index. A trigger-maintained tsvector column
+# on books_book (not on the model, like the SQLite FTS table) keeps search indexed.
+POSTGRES_SEARCH = [
+    """
+    CREATE FUNCTION books_book_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector(
+            'simple', (SELECT name FROM books_author WHERE id = NEW.author_id) || ' ' || NEW.title
+        );
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE FUNCTION books_author_search_vector() RETURNS trigger AS $$
+    BEGIN
+        UPDATE books_book SET search_vector = to_tsvector('simple', NEW.name || ' ' || title)
+        WHERE author_id = NEW.id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    "ALTER TABLE books_book ADD COLUMN search_vector tsvector",
+    """
+    UPDATE books_book SET search_vector = to_tsvector('simple', books_author.name || ' ' || books_book.title)
+    FROM books_author WHERE books_author.id = books_book.author_id
+    """,
+    """
+    CREATE TRIGGER books_book_search_vector BEFORE INSERT OR UPDATE OF author_id, title ON books_book
+    FOR EACH ROW EXECUTE PROCEDURE books_book_search_vector()
+    """,
+    """
+    CREATE TRIGGER books_author_search_vector AFTER UPDATE OF name ON books_author
+    FOR EACH ROW EXECUTE PROCEDURE books_author_search_vector()
+    """,
+    "CREATE INDEX books_book_search_vector_idx ON books_book USING GIN (search_vector)",
+]
+
+POSTGRES_DROP_SEARCH = [
+    "DROP TRIGGER books_author_search_vector ON books_author",
+    "DROP TRIGGER books_book_search_vector ON books_book",
+    "ALTER TABLE books_book DROP COLUMN search_vector",
+    "DROP FUNCTION books_author_search_vector()",
+    "DROP FUNCTION books_book_search_vector()",
+]
+
+
+def run_on_postgres(*statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "postgresql":
+            for statement in statements:
+                schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_version'),
+    ]
+
+    operations = [
+        # Recreated in reverse once the name column is back, so 0002 can still drop it
+        migrations.RunPython(
+            run_on_postgres("DROP INDEX books_book_search_idx"),
+            run_on_postgres(
+                "CREATE INDEX books_book_search_idx ON books_book "
+                "USING GIN (to_tsvector('simple', books_book.author || ' ' || books_book.title))"
+            ),
+        ),
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('book_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['book_count'], name='books_author_count_idx'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='author_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    to='books.author'),
+        ),
+        migrations.RunPython(create_authors, restore_names),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='books_book_author_title_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='books_book_author_idx',
+        ),
+        # Only so that reversing the RemoveField below can fill the column in before restore_names()
+        migrations.AlterField(
+            model_name='book',
+            name='author',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='author',
+        ),
+        migrations.RenameField(
+            model_name='book',
+            old_name='author_ref',
+            new_name='author',
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='books', to='books.author'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author'], name='books_book_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'title'], name='books_book_author_title_idx'),
+        ),
+        migrations.RunPython(run_on_postgres(*POSTGRES_SEARCH), run_on_postgres(*POSTGRES_DROP_SEARCH)),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+def record_existing(apps, schema_editor):
+    Book = apps.get_model("books", "Book")
+    BookChange = apps.get_model("books", "BookChange")
+    books, changes = Book._meta.db_table, BookChange._meta.db_table
+
+    # Clients syncing from the start of the log get the books that predate it as creations
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {changes} (book_id, action, changed_at) "
+            f"SELECT id, 'created', CURRENT_TIMESTAMP FROM {books} ORDER BY id"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_author'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=7)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(record_existing, migrations.RunPython.noop),
+    ]
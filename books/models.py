@@ -1,6 +1,265 @@
-from django.db import models
-
-
-class Book(models.Model):
-    author = models.CharField(max_length=255)
-    title = models.CharField(max_length=255)
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import NotSupportedError, connections, models, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from books.signals import books_changed
+
+
+def notify_changed(using):
+    # Listeners run after commit so nobody re-reads rows a rollback would undo
+    transaction.on_commit(lambda: books_changed.send(sender=Book), using=using)
+
+
+class AuthorQuerySet(models.QuerySet):
+    def resolve(self, names):
+        # {name: Author} for all names, the missing ones created; one query when they all exist
+        names = set(names)
+        authors = {author.name: author for author in self.filter(name__in=names)}
+        missing = names.difference(authors)
+        if missing:
+            # A concurrent writer may create the same names, so conflicts are ignored and the rows read back
+            self.bulk_create([Author(name=name) for name in missing], ignore_conflicts=True)
+            authors.update((author.name, author) for author in self.filter(name__in=missing))
+        return authors
+
+    def adjust_book_counts(self, deltas):
+        # {author_id: delta}; one UPDATE per distinct delta, which for a batch of writes is usually one or two
+        ids_by_delta = defaultdict(list)
+        for author_id, delta in deltas.items():
+            if delta:
+                ids_by_delta[delta].append(author_id)
+        for delta, ids in ids_by_delta.items():
+            self.filter(id__in=ids).update(book_count=F("book_count") + delta)
+
+    def update(self, **kwargs):
+        if "name" not in kwargs:
+            return super().update(**kwargs)
+        # Books show their author's name, so a rename changes each of them: versions, the change log, the cache
+        with transaction.atomic(using=self.db, savepoint=False):
+            ids = list(self.select_for_update().values_list("pk", flat=True))
+            rows = super().update(**kwargs)
+            Book.objects.using(self.db).filter(author__in=ids).update()
+        return rows
+
+    update.alters_data = True
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    # Maintained by every Book write path, see BookQuerySet; never aggregated per request
+    book_count = models.PositiveIntegerField(default=0)
+
+    objects = AuthorQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["book_count"], name="books_author_count_idx"),
+        ]
+
+    # The name the row has in the database, to tell a rename from other writes
+    saved_name = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        author = super().from_db(db, field_names, values)
+        author.saved_name = author.__dict__.get("name")
+        return author
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(Author, instance=self)
+        update_fields = kwargs.get("update_fields")
+        renaming = not self._state.adding and (update_fields is None or "name" in update_fields)
+
+        with transaction.atomic(using=using, savepoint=False):
+            if renaming and self.saved_name is None:
+                self.saved_name = Author.objects.using(using).values_list("name", flat=True).get(pk=self.pk)
+            super().save(*args, **kwargs)
+            if renaming and self.name != self.saved_name:
+                # Same as AuthorQuerySet.update(name=...)
+                Book.objects.using(using).filter(author=self.pk).update()
+        self.saved_name = self.name
+
+
+class BookChangeQuerySet(models.QuerySet):
+    def record(self, action, book_ids):
+        connection = connections[self.db]
+        if connection.vendor == "postgresql":
+            # Change ids must become visible in order, or a reader could move its cursor past one not yet
+            # committed. Writers take this lock until commit; SQLite serializes writers anyway.
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [BookChange.LOCK_ID])
+        self.bulk_create(
+            [BookChange(book_id=pk, action=action) for pk in book_ids], batch_size=settings.BOOKS_BULK_BATCH_SIZE
+        )
+
+
+# Append-only log written by every Book write path, see BookQuerySet; its id is the /books/changes/ cursor
+class BookChange(models.Model):
+    class Action(models.TextChoices):
+        CREATED = "created"
+        UPDATED = "updated"
+        DELETED = "deleted"
+
+    LOCK_ID = 24020001
+
+    # Not a foreign key: tombstones outlive their books
+    book_id = models.IntegerField()
+    action = models.CharField(max_length=7, choices=Action.choices)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BookChangeQuerySet.as_manager()
+
+
+class BookQuerySet(models.QuerySet):
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
+        if ignore_conflicts:
+            # Skipped rows would leave the change log and the author counts wrong
+            raise NotSupportedError("Book.objects.bulk_create() does not support ignore_conflicts.")
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            if connections[self.db].features.can_return_rows_from_bulk_insert:
+                objs = super().bulk_create(objs, batch_size=batch_size)
+            else:
+                self.insert_each(objs)
+            Author.objects.using(self.db).adjust_book_counts(Counter(obj.author_id for obj in objs))
+            BookChange.objects.using(self.db).record(BookChange.Action.CREATED, [obj.pk for obj in objs])
+        notify_changed(self.db)
+        return objs
+
+    def insert_each(self, objs):
+        # Backends without RETURNING on multi-row inserts (SQLite here) give no ids back from bulk_create(), so the
+        # rows go in one INSERT each, within the caller's transaction, and get their ids like save() does
+        opts = self.model._meta
+        self._prepare_for_bulk_create(objs)
+        for obj in objs:
+            fields = [field for field in opts.concrete_fields if obj.pk is not None or field is not opts.auto_field]
+            [returned] = self._insert([obj], fields=fields, returning_fields=opts.db_returning_fields, using=self.db)
+            for value, field in zip(returned, opts.db_returning_fields):
+                setattr(obj, field.attname, value)
+            obj._state.adding = False
+            obj._state.db = self.db
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # Same bookkeeping as Book.save(), which bulk_update bypasses
+        objs = list(objs)
+        now = timezone.now()
+        for obj in objs:
+            obj.version += 1
+            obj.updated_at = now
+        fields = [*fields, *(field for field in ["version", "updated_at"] if field not in fields)]
+
+        # Runs one update() per batch, which records the changes and adjusts the author counts
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = super().bulk_update(objs, fields, batch_size=batch_size)
+        notify_changed(self.db)
+        return rows
+
+    bulk_update.alters_data = True
+
+    def update(self, **kwargs):
+        kwargs.setdefault("version", F("version") + 1)
+        kwargs.setdefault("updated_at", timezone.now())
+
+        # author= and author_id= both move books
+        field = self.model._meta.get_field("author")
+        keys = [key for key in (field.name, field.attname) if key in kwargs]
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # The rows about to change, for the change log and the author counts
+            books = list(self.select_for_update().values_list("pk", "author"))
+            rows = super().update(**kwargs)
+            deltas = Counter()
+            if keys:
+                deltas.subtract(author for _, author in books)
+                author = kwargs[keys[0]]
+                if hasattr(author, "resolve_expression"):
+                    # An expression, such as the Case of a bulk_update() batch: the new authors are read back
+                    moved = self.model._base_manager.using(self.db).filter(pk__in=[pk for pk, _ in books])
+                    deltas.update(moved.values_list("author", flat=True))
+                else:
+                    deltas[getattr(author, "pk", author)] += len(books)
+            Author.objects.using(self.db).adjust_book_counts(deltas)
+            BookChange.objects.using(self.db).record(BookChange.Action.UPDATED, [pk for pk, _ in books])
+        notify_changed(self.db)
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            books = list(self.select_for_update().values_list("pk", "author"))
+            deleted = super().delete()
+            deltas = Counter()
+            deltas.subtract(author for _, author in books)
+            Author.objects.using(self.db).adjust_book_counts(deltas)
+            BookChange.objects.using(self.db).record(BookChange.Action.DELETED, [pk for pk, _ in books])
+        notify_changed(self.db)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class Book(models.Model):
+    # Indexed by books_book_author_idx below instead of the default FK index
+    author = models.ForeignKey(Author, on_delete=models.PROTECT, related_name="books", db_index=False)
+    title = models.CharField(max_length=255)
+    # Maintained by every write path, see BookQuerySet; ETags and Last-Modified are derived from them
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["author"], name="books_book_author_idx"),
+            models.Index(fields=["title"], name="books_book_title_idx"),
+            models.Index(fields=["author", "title"], name="books_book_author_title_idx"),
+        ]
+
+    # The author the row has in the database, for the author book counts
+    saved_author_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        book.saved_author_id = book.__dict__.get("author_id")
+        return book
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(Book, instance=self)
+        update_fields = kwargs.get("update_fields")
+        deltas = Counter()
+        adding = self._state.adding
+        if adding:
+            deltas[self.author_id] += 1
+        else:
+            self.version += 1
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "version", "updated_at"}
+
+        with transaction.atomic(using=using, savepoint=False):
+            if not adding and (update_fields is None or "author" in update_fields):
+                if self.saved_author_id is None:
+                    self.saved_author_id = Book.objects.using(using).values_list("author", flat=True).get(pk=self.pk)
+                deltas[self.author_id] += 1
+                deltas[self.saved_author_id] -= 1
+            super().save(*args, **kwargs)
+            Author.objects.using(using).adjust_book_counts(deltas)
+            action = BookChange.Action.CREATED if adding else BookChange.Action.UPDATED
+            BookChange.objects.using(using).record(action, [self.pk])
+        self.saved_author_id = self.author_id
+        notify_changed(using)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get("using") or self._state.db
+        pk = self.pk
+        with transaction.atomic(using=using, savepoint=False):
+            deleted = super().delete(*args, **kwargs)
+            Author.objects.using(using).adjust_book_counts({self.author_id: -1})
+            BookChange.objects.using(using).record(BookChange.Action.DELETED, [pk])
+        notify_changed(using)
+        return deleted
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+# Keyset pagination over the ordering field, enabled by ?cursor= or ?page_size=
+class BookCursorPagination(CursorPagination):
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Plain GET /books/ keeps returning a bare list for existing clients
+        if not any(param in request.query_params for param in (self.cursor_query_param, self.page_size_query_param)):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+# Search results are ordered by rank, which has no keyset, so they are paged by number
+class BookSearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
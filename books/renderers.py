@@ -0,0 +1,40 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from books.serializers import BookSerializer
+
+FIELDS = BookSerializer.Meta.fields
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, list):
+            # An error body, such as {"detail": ...}, is one line rather than a line per key
+            data = [data]
+        return "".join(self.render_row(item) for item in data).encode(self.charset)
+
+    @staticmethod
+    def render_row(item):
+        return json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(data or [])
+        return buffer.getvalue().encode(self.charset)
@@ -0,0 +1,101 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from books.models import Author, Book
+
+FTS_TABLE = "books_fts"
+
+# (name, body) pairs; recreated after every migrate because SQLite drops triggers when Django rebuilds a table.
+# The index keeps the author's name, so renaming an author updates the rows of all their books.
+SQLITE_TRIGGERS = [
+    ("books_fts_insert", """
+        AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, author, title)
+            VALUES (new.id, (SELECT name FROM {authors} WHERE id = new.author_id), new.title);
+        END
+    """),
+    ("books_fts_update", """
+        AFTER UPDATE OF author_id, title ON {table} BEGIN
+            UPDATE {fts} SET author = (SELECT name FROM {authors} WHERE id = new.author_id), title = new.title
+            WHERE rowid = old.id;
+        END
+    """),
+    ("books_fts_delete", """
+        AFTER DELETE ON {table} BEGIN
+            DELETE FROM {fts} WHERE rowid = old.id;
+        END
+    """),
+    ("books_fts_author_rename", """
+        AFTER UPDATE OF name ON {authors} BEGIN
+            UPDATE {fts} SET author = new.name WHERE rowid IN (SELECT id FROM {table} WHERE author_id = new.id);
+        END
+    """),
+]
+
+# Kept up to date by triggers and GIN-indexed, see migration 0005
+POSTGRES_VECTOR = "{table}.search_vector"
+
+
+# Before migrate as well: a trigger on the authors table would break SQLite's rebuild of the books table
+def drop_triggers(using="default", **kwargs):
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for name, _ in SQLITE_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def install_triggers(using="default", **kwargs):
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        # Not on a schema migrated back past the search index or the authors table
+        if not {FTS_TABLE, Author._meta.db_table} <= set(connection.introspection.table_names(cursor)):
+            return
+        for name, body in SQLITE_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"CREATE TRIGGER {name} " + body.format(
+                table=Book._meta.db_table, authors=Author._meta.db_table, fts=FTS_TABLE
+            ))
+
+
+def search_books(queryset, query):
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return queryset.none()
+
+    table = Book._meta.db_table
+    vendor = connections[queryset.db].vendor
+
+    if vendor == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        return queryset.extra(
+            select={"rank": f"{FTS_TABLE}.rank"},
+            tables=[FTS_TABLE],
+            where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+            params=[match],
+            order_by=["rank", "id"],
+        )
+
+    if vendor == "postgresql":
+        vector = POSTGRES_VECTOR.format(table=table)
+        tsquery = "to_tsquery('simple', %s)"
+        match = " & ".join(f"{term}:*" for term in terms)
+        return queryset.extra(
+            select={"rank": f"ts_rank({vector}, {tsquery})"},
+            select_params=[match],
+            where=[f"{vector} @@ {tsquery}"],
+            params=[match],
+            order_by=["-rank", "id"],
+        )
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(author__name__icontains=term) | Q(title__icontains=term)
+    return queryset.filter(condition).order_by("id")
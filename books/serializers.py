@@ -0,0 +1,93 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from books.models import Author, Book
+
+# values() lookups behind BookSerializer fields, for the read paths that bypass the serializer
+COLUMNS = {"author": "author__name"}
+
+# Largest integer a query parameter can carry to the database; a larger one fails the query instead of matching nothing
+MAX_QUERY_INT = 2 ** 63 - 1
+
+
+def resolve_authors(items):
+    # Author names in validated data are replaced by Author rows, looked up in one query per batch
+    authors = Author.objects.resolve(attrs["author"] for attrs in items if "author" in attrs)
+    for attrs in items:
+        if "author" in attrs:
+            attrs["author"] = authors[attrs["author"]]
+    return items
+
+
+# Authors are read and written by name; querysets serialized with it should select_related("author")
+class AuthorNameField(serializers.CharField):
+    def to_representation(self, value):
+        return value.name
+
+
+class BookListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        books = [Book(**attrs) for attrs in resolve_authors(validated_data)]
+        return Book.objects.bulk_create(books, batch_size=settings.BOOKS_BULK_BATCH_SIZE)
+
+    def update(self, instance, validated_data):
+        resolve_authors(validated_data)
+        fields = set()
+        for book, attrs in zip(instance, validated_data):
+            for attr, value in attrs.items():
+                setattr(book, attr, value)
+            fields.update(attrs)
+
+        if fields:
+            Book.objects.bulk_update(instance, fields=sorted(fields), batch_size=settings.BOOKS_BULK_BATCH_SIZE)
+        return instance
+
+
+class BookSerializer(serializers.ModelSerializer):
+    author = AuthorNameField(max_length=255)
+
+    # fields= keeps only the named fields, exclude= drops them; both in Meta.fields order
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for param, names in [("fields", fields), ("exclude", exclude)]:
+            unknown = set(names or ()) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({param: [f"Неизвестные поля: {', '.join(sorted(unknown))}."]})
+
+        for name in list(self.fields):
+            if (fields is not None and name not in fields) or (exclude is not None and name in exclude):
+                self.fields.pop(name)
+        if not self.fields:
+            raise serializers.ValidationError({"fields": ["Не выбрано ни одного поля."]})
+
+    def create(self, validated_data):
+        return super().create(*resolve_authors([validated_data]))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, *resolve_authors([validated_data]))
+
+    class Meta:
+        model = Book
+        fields = ["id", "author", "title"]
+        read_only_fields = ["id"]
+        list_serializer_class = BookListSerializer
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Author
+        fields = ["id", "name", "book_count"]
+
+
+# ?ids= of /books/, split on commas by the view
+class BookIdsQuerySerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=MAX_QUERY_INT), allow_empty=False)
+
+
+# Query parameters of /books/changes/
+class BookChangesQuerySerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, max_value=MAX_QUERY_INT, default=0)
+    page_size = serializers.IntegerField(
+        min_value=1, max_value=settings.BOOKS_CHANGES_MAX_PAGE_SIZE, default=settings.BOOKS_CHANGES_PAGE_SIZE
+    )
+    wait = serializers.FloatField(min_value=0, max_value=settings.BOOKS_CHANGES_MAX_WAIT, default=0)
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent after commit whenever Book rows are created, updated or deleted, bulk paths included
+books_changed = Signal()
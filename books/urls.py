@@ -1,8 +1,26 @@
-from django.urls import path
-
-from books.views import BookList, BookDetail
-
-urlpatterns = [
-    path("", BookList.as_view(), name="book-list"),
-    path("<int:pk>", BookDetail.as_view(), name="book-detail"),
-]
+from django.conf import settings
+from django.urls import path
+
+from books.views import AuthorList, BookList, BookDetail, BookBulk, BookCacheStats, BookChanges, BookExport
+from books.views_async import long_poll, offload
+
+
+def handler(view):
+    return offload(view) if settings.BOOKS_ASYNC_VIEWS else view
+
+
+def changes_handler():
+    if settings.BOOKS_ASYNC_VIEWS:
+        return long_poll(offload(BookChanges.as_view(blocking=False)))
+    return BookChanges.as_view()
+
+
+urlpatterns = [
+    path("", handler(BookList.as_view()), name="book-list"),
+    path("<int:pk>", handler(BookDetail.as_view()), name="book-detail"),
+    path("bulk/", handler(BookBulk.as_view()), name="book-bulk"),
+    path("authors/", handler(AuthorList.as_view()), name="author-list"),
+    path("changes/", changes_handler(), name="book-changes"),
+    path("export/", BookExport.as_view(), name="book-export"),
+    path("cache/stats/", BookCacheStats.as_view(), name="book-cache-stats"),
+]
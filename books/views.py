@@ -1,27 +1,323 @@
-from rest_framework import serializers, generics
-from rest_framework.permissions import AllowAny
-
-from books.models import Book
-
-
-class BookSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Book
-        fields = ["id", "author", "title"]
-        read_only_fields = ["id"]
-
-
-# /books/
-class BookList(generics.ListCreateAPIView):
-    serializer_class = BookSerializer
-    permission_classes = [AllowAny]
-    queryset = Book.objects.all()
-
-
-# /books/<pk:int>
-class BookDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Book.objects.all()
-    serializer_class = BookSerializer
-    lookup_field = "id"
-    lookup_url_kwarg = "pk"
-    permission_classes = [AllowAny]
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import generics, permissions, status
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+
+from books import cache, conditional
+from books.cache import CachedResponseMixin
+from books.changes import get_changes, wait_for_changes
+from books.export import export_books
+from books.filters import BookFieldFilter, BookSearchFilter, StableOrderingFilter
+from books.models import Author, Book
+from books.pagination import BookCursorPagination, BookSearchPagination
+from books.renderers import NDJSONRenderer, CSVRenderer
+from books.serializers import (
+    COLUMNS, AuthorSerializer, BookChangesQuerySerializer, BookIdsQuerySerializer, BookSerializer,
+)
+
+
+# ?fields=id,title or ?exclude=author on reads; only the selected columns are fetched
+class SparseFieldsMixin:
+    def get_fields(self):
+        params = self.request.query_params
+        fields, exclude = [
+            [name.strip() for name in params[param].split(",") if name.strip()] if param in params else None
+            for param in ("fields", "exclude")
+        ]
+        return list(BookSerializer(fields=fields, exclude=exclude).fields)
+
+    def get_values(self, queryset, fields, keys):
+        # Rows are keyed by lookup (see COLUMNS) and carry the keys the pagination or the validators need;
+        # project() turns them into the serializer's fields
+        columns = [COLUMNS.get(name, name) for name in fields]
+        hidden = [key for key in keys if key not in columns]
+        return queryset.values(*columns, *hidden, *conditional.VERSION_FIELDS), columns
+
+    def project(self, rows, fields, columns):
+        rows[:] = [{field: row[column] for field, column in zip(fields, columns)} for row in rows]
+        return rows
+
+
+# /books/
+class BookList(SparseFieldsMixin, CachedResponseMixin, generics.ListCreateAPIView):
+    serializer_class = BookSerializer
+    permission_classes = [AllowAny]
+    queryset = Book.objects.select_related("author")
+    pagination_class = BookCursorPagination
+    filter_backends = [BookFieldFilter, StableOrderingFilter, BookSearchFilter]
+    # Indexed columns only; see Book.Meta.indexes
+    ordering_fields = ["id", "author", "title"]
+    ordering_columns = COLUMNS
+    ordering = ["id"]
+    ids_param = "ids"
+
+    def list(self, request, *args, **kwargs):
+        if self.ids_param in request.query_params:
+            return self.list_ids(request)
+
+        # Rows straight from values(); same output as BookSerializer without its per-field machinery
+        fields = self.get_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        keys = ["id"]
+        if isinstance(self.paginator, CursorPagination):
+            # Cursors are built from the ordering columns of the page's rows
+            ordering = self.paginator.get_ordering(request, queryset, self)
+            keys += [name.lstrip("-") for name in ordering if name.lstrip("-") not in keys]
+        queryset, columns = self.get_values(queryset, fields, keys)
+
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        etag = conditional.make_etag(request, conditional.pop_versions(rows))
+        last_modified = cache.get_changed_at()
+
+        response = conditional.evaluate(request, etag, last_modified)
+        if response is None:
+            response = self.get_paginated_response(rows) if page is not None else Response(rows)
+        # The links are built by now, the rows are rendered later
+        self.project(rows, fields, columns)
+        return conditional.set_validators(response, etag, last_modified)
+
+    def get_ids(self):
+        ids = [pk.strip() for pk in self.request.query_params[self.ids_param].split(",") if pk.strip()]
+        params = BookIdsQuerySerializer(data={"ids": ids})
+        if not params.is_valid():
+            raise ValidationError({self.ids_param: ["Ожидался список id через запятую."]})
+        ids = list(dict.fromkeys(params.validated_data["ids"]))
+        if len(ids) > settings.BOOKS_BATCH_MAX_IDS:
+            raise ValidationError({self.ids_param: [f"Не более {settings.BOOKS_BATCH_MAX_IDS} id за запрос."]})
+        return ids
+
+    # ?ids=3,1,2: the books in the requested order and the ids not found, in place of the other filters and paging.
+    # Books are cached one by one, so only the ids not cached under the current version are fetched.
+    def list_ids(self, request):
+        fields = self.get_fields()
+        ids = self.get_ids()
+        usable = cache.is_usable()
+        version = cache.get_version()
+        entries = cache.get_books(version, ids) if usable else {}
+
+        uncached = [pk for pk in ids if pk not in entries]
+        if uncached:
+            books = list(self.get_queryset().in_bulk(uncached).values())
+            fetched = {
+                book.id: (data, book.version, book.updated_at)
+                for book, data in zip(books, BookSerializer(books, many=True).data)
+            }
+            if usable:
+                cache.set_books(version, fetched)
+            entries.update(fetched)
+
+        found = [pk for pk in ids if pk in entries]
+        etag = conditional.make_etag(request, [(pk, *entries[pk][1:]) for pk in found])
+        last_modified = cache.get_changed_at()
+
+        response = conditional.evaluate(request, etag, last_modified)
+        if response is None:
+            response = Response({
+                "results": [{field: entries[pk][0][field] for field in fields} for pk in found],
+                "missing": [pk for pk in ids if pk not in entries],
+            })
+        return conditional.set_validators(response, etag, last_modified)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator") and BookSearchFilter.search_param in self.request.query_params:
+            self._paginator = BookSearchPagination()
+        return super().paginator
+
+
+# /books/<pk:int>
+class BookDetail(SparseFieldsMixin, CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Book.objects.select_related("author")
+    serializer_class = BookSerializer
+    lookup_field = "id"
+    lookup_url_kwarg = "pk"
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in permissions.SAFE_METHODS:
+            # Nobody may change the row between the If-Match check and the write
+            queryset = queryset.select_for_update(of=("self",))
+        return queryset
+
+    def get_object(self):
+        book = self.book = super().get_object()
+        if self.request.method not in permissions.SAFE_METHODS:
+            # If-Match / If-Unmodified-Since on PUT, PATCH and DELETE
+            etag, last_modified = self.get_validators(book.id, book.version, book.updated_at)
+            if conditional.evaluate(self.request, etag, last_modified) is not None:
+                raise conditional.PreconditionFailed()
+        return book
+
+    def get_validators(self, pk, version, updated_at):
+        return conditional.make_etag(self.request, [(pk, version, updated_at)]), int(updated_at.timestamp())
+
+    def retrieve(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        queryset, columns = self.get_values(self.filter_queryset(self.get_queryset()), fields, ["id"])
+        instance = generics.get_object_or_404(queryset, **{self.lookup_field: self.kwargs[self.lookup_url_kwarg]})
+        self.check_object_permissions(request, instance)
+        [versions] = conditional.pop_versions([instance])
+        [instance] = self.project([instance], fields, columns)
+        etag, last_modified = self.get_validators(*versions)
+
+        response = conditional.evaluate(request, etag, last_modified)
+        if response is None:
+            response = Response(instance)
+        return conditional.set_validators(response, etag, last_modified)
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            response = super().update(request, *args, **kwargs)
+        # save() has bumped the version on this same instance
+        return conditional.set_validators(
+            response, *self.get_validators(self.book.id, self.book.version, self.book.updated_at)
+        )
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+
+# /books/bulk/
+class BookBulk(generics.GenericAPIView):
+    serializer_class = BookSerializer
+    permission_classes = [AllowAny]
+    queryset = Book.objects.select_related("author")
+
+    def check_items(self, items):
+        if not isinstance(items, list):
+            return {"non_field_errors": ["Ожидался список."]}
+        if len(items) > settings.BOOKS_BULK_MAX_ITEMS:
+            return {"non_field_errors": [f"Не более {settings.BOOKS_BULK_MAX_ITEMS} элементов за запрос."]}
+        return None
+
+    def post(self, request, *args, **kwargs):
+        errors = self.check_items(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        errors = self.check_items(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = [item.get("id") if isinstance(item, dict) else None for item in request.data]
+        books = self.get_queryset().in_bulk([pk for pk in ids if type(pk) is int])
+
+        errors, seen = [], set()
+        for pk in ids:
+            if type(pk) is not int or pk not in books:
+                errors.append({"id": ["Книга не найдена."]})
+            elif pk in seen:
+                errors.append({"id": ["Повторяющийся id."]})
+            else:
+                errors.append({})
+                seen.add(pk)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer([books[pk] for pk in ids], data=request.data, many=True, partial=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            serializer.save()
+        return Response(serializer.data)
+
+    def delete(self, request, *args, **kwargs):
+        ids = request.data.get("ids") if isinstance(request.data, dict) else request.data
+        errors = self.check_items(ids)
+        if errors:
+            return Response({"ids": errors["non_field_errors"]}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(type(pk) is int for pk in ids):
+            return Response({"ids": ["Ожидался список id."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            deleted, _ = self.get_queryset().filter(id__in=ids).delete()
+        return Response({"deleted": deleted})
+
+
+# /books/authors/
+class AuthorList(generics.ListAPIView):
+    serializer_class = AuthorSerializer
+    permission_classes = [AllowAny]
+    # Authors stay when their last book is deleted, but aren't listed
+    queryset = Author.objects.filter(book_count__gt=0)
+    pagination_class = BookCursorPagination
+    filter_backends = [StableOrderingFilter]
+    ordering_fields = ["id", "name", "book_count"]
+    ordering = ["name"]
+
+
+# /books/changes/?since=<cursor>&page_size=&wait=<seconds>
+class BookChanges(APIView):
+    permission_classes = [AllowAny]
+    # With ?wait= and nothing after the cursor, the request is held until a change or the timeout;
+    # under ASGI views_async.long_poll waits instead, with blocking=False
+    blocking = True
+
+    def get(self, request, *args, **kwargs):
+        params = BookChangesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        since, page_size, wait = (params.validated_data[name] for name in ("since", "page_size", "wait"))
+
+        if wait and self.blocking:
+            wait_for_changes(since, wait)
+        changes, cursor, more = get_changes(since, page_size)
+        return Response({
+            "changes": changes,
+            "cursor": cursor,
+            "more": more,
+            "next": replace_query_param(request.build_absolute_uri(), "since", cursor),
+        })
+
+
+# /books/cache/stats/
+class BookCacheStats(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        lookups = cache.stats["hits"] + cache.stats["misses"]
+        return Response({
+            "version": cache.get_version(),
+            "hits": cache.stats["hits"],
+            "misses": cache.stats["misses"],
+            "hit_ratio": cache.stats["hits"] / lookups if lookups else None,
+        })
+
+
+# /books/export/?format=ndjson|csv
+class BookExport(APIView):
+    permission_classes = [AllowAny]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        compress = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+
+        response = StreamingHttpResponse(
+            export_books(renderer.format, compress=compress),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response["Content-Disposition"] = f'attachment; filename="books.{renderer.format}"'
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from books.changes import ChangeWatch
+from books.serializers import BookChangesQuerySerializer
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.BOOKS_ASYNC_MAX_WORKERS, thread_name_prefix="books")
+    return _executor
+
+
+def run_in_pool(func, *args, **kwargs):
+    # Pool threads live across requests, so they manage their own connections like a WSGI worker does
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    return response
+
+
+# Django serves sync views under ASGI on one shared thread; this turns a sync view into a native async one
+# that runs it, rendering included, on a bounded pool while the event loop keeps accepting slow clients
+def offload(view):
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # The pool does not carry context variables over on its own, and the database router relies on them
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, run_in_pool, run_view, view, request, *args, **kwargs)
+        return await loop.run_in_executor(get_executor(), call)
+
+    # csrf_exempt() would wrap the coroutine function in a sync one
+    async_view.csrf_exempt = getattr(view, "csrf_exempt", False)
+    return async_view
+
+
+async def wait_for_changes(since, timeout):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    watch = ChangeWatch(since)
+    while not await loop.run_in_executor(get_executor(), run_in_pool, watch.check):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(settings.BOOKS_CHANGES_POLL_INTERVAL, remaining))
+    return True
+
+
+# ?wait= on /books/changes/ under ASGI: the waiting happens on the event loop and only the checks take a pool
+# thread, so idle long-poll clients don't exhaust the pool. `view` must not wait itself, see BookChanges.
+def long_poll(view):
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        params = BookChangesQuerySerializer(data=request.GET)
+        # Invalid parameters are left for the view to report
+        if params.is_valid() and params.validated_data["wait"]:
+            await wait_for_changes(params.validated_data["since"], params.validated_data["wait"])
+        return await view(request, *args, **kwargs)
+
+    async_view.csrf_exempt = getattr(view, "csrf_exempt", False)
+    return async_view
@@ -1,9 +1,14 @@
-import os
-
-from celery import Celery
-
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "conf.settings")
-
-app = Celery("skillfactory")
-app.config_from_object("django.conf:settings", namespace="CELERY")
-app.autodiscover_tasks()
+import os
+
+from celery import Celery, signals
+
+from core import metrics
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "skillfactory.settings")
+
+app = Celery("skillfactory")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
+
+# Task metrics are recorded wherever tasks run: in a worker, or in the caller when CELERY_TASK_ALWAYS_EAGER is set
+metrics.connect_celery(signals)
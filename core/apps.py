@@ -1,5 +1,9 @@
-from django.apps import AppConfig
-
-
-class CoreConfig(AppConfig):
-    name = "core"
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    name = "core"
+
+    def ready(self):
+        import core.metrics  # noqa: F401
+        import core.user_cache  # noqa: F401
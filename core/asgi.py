@@ -0,0 +1,46 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers import asgi
+from django.db import connections
+
+DONE = object()
+
+
+# Django 3.2 iterates streaming responses on the event loop, where a generator that queries the database fails
+# with SynchronousOnlyOperation and any other holds up every request on the loop. Here the parts are produced
+# on a thread of their own, one per response so the generator keeps its database connection throughout.
+class ASGIHandler(asgi.ASGIHandler):
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode("ascii"), value.encode("latin1")) for header, value in response.items()
+        ] + [
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip()) for cookie in response.cookies.values()
+        ]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream")
+        parts = iter(response)
+        try:
+            while True:
+                part = await loop.run_in_executor(executor, next, parts, DONE)
+                if part is DONE:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body"})
+        finally:
+            # Also when the client went away mid-stream: the generator and its connection are closed on their thread
+            await loop.run_in_executor(executor, close, response)
+            executor.shutdown(wait=False)
+
+
+def close(response):
+    try:
+        response.close()
+    finally:
+        connections.close_all()
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from core.models import User
+from core.user_cache import FIELDS, cache_key, get_cache, local_cache
+
+
+# JWTAuthentication that resolves the token's user from the local LRU, then the shared cache, then the DB.
+# The row is always read from the primary: one from a lagging replica could miss a deactivation or password
+# change and be cached again right after the invalidation, for the whole AUTH_USER_CACHE_TIMEOUT.
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        key = cache_key(user_id)
+        values = local_cache.get(key)
+        if values is None:
+            values = get_cache().get(key)
+            if values is not None:
+                local_cache.set(key, values)
+        if values is not None:
+            user = User.from_db(DEFAULT_DB_ALIAS, FIELDS, values)
+            # Same check as the uncached path, for an entry cached before the user was deactivated
+            if not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            return user
+
+        try:
+            user = User.objects.using(DEFAULT_DB_ALIAS).get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        values = tuple(getattr(user, field) for field in FIELDS)
+        get_cache().set(key, values, settings.AUTH_USER_CACHE_TIMEOUT)
+        local_cache.set(key, values)
+        return user
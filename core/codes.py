@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from core.redis_client import get_redis
+
+PENDING_KEY = "confirm:pending"
+
+_store = None
+
+
+def get_code_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.CONFIRM_CODE_STORE)()
+    return _store
+
+
+@receiver(setting_changed)
+def reset_code_store(setting, **kwargs):
+    global _store
+    if setting == "CONFIRM_CODE_STORE":
+        _store = None
+
+
+class RedisCodeStore:
+    # GET + compare + DEL in one round trip, so a code can only ever be used once
+    CONSUME_SCRIPT = """
+        if redis.call("GET", KEYS[1]) == ARGV[1] then
+            return redis.call("DEL", KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self):
+        self.redis = get_redis(settings.CONFIRM_CODE_REDIS_DB)
+        self.consume_script = self.redis.register_script(self.CONSUME_SCRIPT)
+
+    def set_many(self, codes, ttl=None):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, code in codes.items():
+            pipe.set(key, code, ex=ttl or settings.CONFIRM_CODE_TTL)
+        pipe.execute()
+
+    def delete_many(self, keys):
+        self.redis.delete(*keys)
+
+    def consume(self, key, code):
+        return bool(self.consume_script(keys=[key], args=[code]))
+
+    def push_pending(self, email):
+        return self.redis.rpush(PENDING_KEY, email)
+
+    def pop_pending(self, count):
+        pipe = self.redis.pipeline()
+        pipe.lrange(PENDING_KEY, 0, count - 1)
+        pipe.ltrim(PENDING_KEY, count, -1)
+        pipe.llen(PENDING_KEY)
+        emails, _, remaining = pipe.execute()
+        return [email.decode("utf-8") for email in emails], remaining
+
+
+# Process-local stand-in for tests and local runs without Redis
+class InMemoryCodeStore:
+    def __init__(self):
+        self.codes = {}
+        self.pending = deque()
+        self.lock = threading.Lock()
+
+    def set_many(self, codes, ttl=None):
+        expires = time.monotonic() + (ttl or settings.CONFIRM_CODE_TTL)
+        with self.lock:
+            self.codes.update((key, (code, expires)) for key, code in codes.items())
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.codes.pop(key, None)
+
+    def consume(self, key, code):
+        with self.lock:
+            stored, expires = self.codes.get(key, (None, 0))
+            if stored != code or expires < time.monotonic():
+                return False
+            del self.codes[key]
+            return True
+
+    def push_pending(self, email):
+        with self.lock:
+            self.pending.append(email)
+            return len(self.pending)
+
+    def pop_pending(self, count):
+        with self.lock:
+            emails = [self.pending.popleft() for _ in range(min(count, len(self.pending)))]
+            return emails, len(self.pending)
@@ -0,0 +1,48 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Options are handed to tests/benchmarks/conftest.py through the environment
+OPTIONS = {
+    "sizes": "BENCH_SIZES",
+    "users": "BENCH_USERS",
+    "rounds": "BENCH_ROUNDS",
+    "threshold": "BENCH_THRESHOLD",
+    "baseline": "BENCH_BASELINE",
+    "results": "BENCH_RESULTS",
+}
+
+
+class Command(BaseCommand):
+    help = "Run the benchmarks in tests/benchmarks and fail on regressions against the JSON baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-k", dest="keyword", help="Only run benchmarks matching this pytest -k expression.")
+        parser.add_argument("--sizes", help="Comma separated book table sizes, 1000,100000,1000000 by default.")
+        parser.add_argument("--users", type=int, help="Users seeded for the auth endpoints, 10000 by default.")
+        parser.add_argument("--rounds", type=int, help="Timed calls per benchmark, 50 by default.")
+        parser.add_argument("--threshold", type=float,
+                            help="Allowed p95 latency and peak memory growth over the baseline, 0.25 by default.")
+        parser.add_argument("--baseline", help="Baseline file, tests/benchmarks/baseline.json by default.")
+        parser.add_argument("--results", help="Where this run's results go, tests/benchmarks/results.json by default.")
+        parser.add_argument("--save-baseline", action="store_true", help="Record this run as the new baseline.")
+
+    def handle(self, *args, **options):
+        try:
+            import pytest
+        except ImportError:
+            raise CommandError("pytest and pytest-django are required, install the dev packages.")
+
+        for option, variable in OPTIONS.items():
+            if options[option] is not None:
+                os.environ[variable] = str(options[option])
+        if options["save_baseline"]:
+            os.environ["BENCH_SAVE_BASELINE"] = "1"
+
+        arguments = [str(settings.BASE_DIR / "tests" / "benchmarks"), "-m", "benchmark", "-q"]
+        if options["keyword"]:
+            arguments += ["-k", options["keyword"]]
+        code = pytest.main(arguments)
+        if code:
+            raise CommandError(f"Benchmarks failed, pytest exited with {code}.")
@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.outbox import dispatch_pending, purge_processed
+
+
+class Command(BaseCommand):
+    help = "Publish pending outbox messages to Celery in batches, polling until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Seconds to wait when there is nothing to publish.")
+        parser.add_argument("--once", action="store_true", help="Publish everything pending and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            published = dispatch_pending(options["batch_size"])
+            if published:
+                self.stdout.write(f"Published {published} messages")
+            if published == options["batch_size"]:
+                continue
+            if options["once"]:
+                return
+            purge_processed()
+            time.sleep(options["interval"])
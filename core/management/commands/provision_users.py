@@ -0,0 +1,66 @@
+import csv
+import itertools
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.provisioning import password_pool, provision_users
+
+
+class Command(BaseCommand):
+    help = "Create users from CSV/JSONL files with full_name, email and password columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+")
+        parser.add_argument("--workers", type=int, default=settings.USER_PROVISION_WORKERS,
+                            help="Processes hashing passwords, defaults to the number of CPUs.")
+        parser.add_argument("--batch-size", type=int, default=settings.USER_PROVISION_BATCH_SIZE)
+        parser.add_argument("--send-emails", action="store_true", help="Queue confirmation emails in batches.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        created = failed = 0
+
+        # One pool for the whole run, its processes are reused by every batch
+        with password_pool(options["workers"]) as pool:
+            for path in options["paths"]:
+                rows = self.read(path)
+                offset = 0
+                while True:
+                    batch = list(itertools.islice(rows, options["batch_size"]))
+                    if not batch:
+                        break
+
+                    users, errors = provision_users(
+                        batch, workers=options["workers"], send_emails=options["send_emails"], pool=pool
+                    )
+                    for index, error in errors.items():
+                        self.stderr.write(f"{path}:{offset + index + 1}: {error}")
+
+                    created += len(users)
+                    failed += len(errors)
+                    offset += len(batch)
+                    self.stdout.write(f"{path}: {offset} rows, {created} users created")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Created {created} users, {failed} rows failed in {elapsed:.1f}s"))
+
+    def read(self, path):
+        try:
+            f = open(path, encoding="utf-8", newline="")
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with f:
+            if path.endswith(".csv"):
+                yield from csv.DictReader(f)
+            else:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError as exc:
+                        raise CommandError(f"{path}:{number}: {exc}")
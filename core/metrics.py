@@ -0,0 +1,261 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+# One snapshot file per process lifetime; a restarted worker reusing a pid must not overwrite its predecessor
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+# Each thread records into its own shard without locking; shards are only merged when collected
+class Counter:
+    type = "counter"
+
+    def __init__(self, registry, name, documentation, labels):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.local = threading.local()
+        self.shards = []
+        self.retired = self.new_values()
+
+    def new_values(self):
+        return defaultdict(float)
+
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = self.new_values()
+            with self.registry.lock:
+                self.shards.append((threading.current_thread(), values))
+            return values
+
+    def inc(self, *labels, amount=1):
+        self.shard()[labels] += amount
+
+    def merge(self, values, items):
+        for labels, value in items:
+            values[tuple(labels)] += value
+
+    def collect(self):
+        values = self.new_values()
+        with self.registry.lock:
+            for thread, shard in list(self.shards):
+                if thread.is_alive():
+                    self.merge(values, list(dict(shard).items()))
+                else:
+                    # Finished threads are folded in once, so short-lived threads don't pile up shards
+                    self.shards.remove((thread, shard))
+                    self.merge(self.retired, shard.items())
+            self.merge(values, self.retired.items())
+        return values
+
+    def dump(self):
+        return [[list(labels), value] for labels, value in self.collect().items()]
+
+    def samples(self, values):
+        for labels, value in values.items():
+            yield self.name, dict(zip(self.labels, labels)), value
+
+
+# Bucket counts are kept per bucket and only made cumulative for the exposition, observing is one bisect
+class Histogram(Counter):
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        super().__init__(registry, name, documentation, labels)
+
+    def new_values(self):
+        size = len(self.buckets) + 1
+        return defaultdict(lambda: [0] * size + [0.0])
+
+    def observe(self, value, *labels):
+        try:
+            state = self.local.values[labels]
+        except (AttributeError, KeyError):
+            state = self.shard()[labels]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def merge(self, values, items):
+        for labels, state in items:
+            merged = values[tuple(labels)]
+            for index, value in enumerate(list(state)):
+                merged[index] += value
+
+    def samples(self, values):
+        for labels, state in values.items():
+            labels = dict(zip(self.labels, labels))
+            total = 0
+            for bound, count in zip([*self.buckets, "+Inf"], state):
+                total += count
+                yield f"{self.name}_bucket", {**labels, "le": str(bound)}, total
+            yield f"{self.name}_sum", labels, state[-1]
+            yield f"{self.name}_count", labels, total
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.flush_at = 0
+
+    def counter(self, name, documentation, labels=()):
+        return self.metrics.setdefault(name, Counter(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, documentation, labels, buckets))
+
+    def path(self, directory=None):
+        return os.path.join(directory or settings.METRICS_DIR, f"{PROCESS_ID}.json")
+
+    def flush(self):
+        self.flush_at = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+        if not settings.METRICS_DIR:
+            return
+        data = {name: metric.dump() for name, metric in self.metrics.items()}
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self.path()
+        with open(f"{path}.tmp", "w") as stream:
+            json.dump(data, stream)
+        os.replace(f"{path}.tmp", path)
+
+    def maybe_flush(self):
+        if time.monotonic() >= self.flush_at:
+            self.flush()
+
+    # Sums this process's live values with the last snapshots of every other process sharing METRICS_DIR
+    def collect(self):
+        snapshots = [{name: metric.dump() for name, metric in self.metrics.items()}]
+        if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+            own = os.path.basename(self.path())
+            for filename in os.listdir(settings.METRICS_DIR):
+                if filename.endswith(".json") and filename != own:
+                    try:
+                        with open(os.path.join(settings.METRICS_DIR, filename)) as stream:
+                            snapshots.append(json.load(stream))
+                    except (OSError, ValueError):
+                        continue
+
+        for name, metric in self.metrics.items():
+            values = metric.new_values()
+            for snapshot in snapshots:
+                metric.merge(values, snapshot.get(name, []))
+            yield metric, values
+
+    def exposition(self):
+        lines = []
+        for metric, values in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples(values):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "Request latency by URL name.", ["view", "method", "status"]
+)
+task_duration = registry.histogram("celery_task_duration_seconds", "Celery task run time.", ["task", "state"])
+task_failures = registry.counter("celery_task_failures_total", "Celery tasks that raised.", ["task"])
+redis_duration = registry.histogram(
+    "redis_command_duration_seconds", "Redis command latency.", ["command"], buckets=REDIS_BUCKETS
+)
+db_connections = registry.counter("db_connections_opened_total", "Database connections opened.", ["alias"])
+db_queries = registry.counter("db_queries_total", "Database queries executed.", ["alias"])
+
+
+def observe_redis(execute_command):
+    def wrapper(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return execute_command(self, *args, **options)
+        finally:
+            redis_duration.observe(time.perf_counter() - started, str(args[0]).upper())
+
+    return wrapper
+
+
+def observe_pipeline(execute):
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return execute(self, *args, **kwargs)
+        finally:
+            redis_duration.observe(time.perf_counter() - started, "PIPELINE")
+
+    return wrapper
+
+
+# Called once, by core.redis_client.instrument
+def instrument_redis(redis):
+    redis.Redis.execute_command = observe_redis(redis.Redis.execute_command)
+    redis.client.Pipeline.execute = observe_pipeline(redis.client.Pipeline.execute)
+
+
+def count_query(execute, sql, params, many, context):
+    db_queries.inc(context["connection"].alias)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    db_connections.inc(connection.alias)
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+_started = {}
+
+
+def task_started(task_id=None, **kwargs):
+    _started[task_id] = time.perf_counter()
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    if started is not None:
+        task_duration.observe(time.perf_counter() - started, task.name, state or "UNKNOWN")
+    registry.maybe_flush()
+
+
+def task_failed(sender=None, **kwargs):
+    task_failures.inc(sender.name)
+
+
+def worker_stopped(**kwargs):
+    registry.flush()
+
+
+def connect_celery(signals):
+    signals.task_prerun.connect(task_started)
+    signals.task_postrun.connect(task_finished)
+    signals.task_failure.connect(task_failed)
+    signals.worker_process_shutdown.connect(worker_stopped)
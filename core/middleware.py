@@ -0,0 +1,146 @@
+import cProfile
+import logging
+import os
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core import metrics, profiling
+from core.routers import RequestState, current_request
+
+logger = logging.getLogger(__name__)
+
+METHODS = {"GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"}
+
+
+# Sync and async capable: under ASGI a sync-only middleware would run every request, offloaded book views
+# included, on Django's single sync thread
+class HybridMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Decided once, __call__ checks it on every request
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+# Labelled by URL name rather than path, so /books/<pk> stays one series; unknown URLs share "unresolved"
+class MetricsMiddleware(HybridMiddleware):
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        return self.observe(request, self.get_response(request), started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        return self.observe(request, await self.get_response(request), started)
+
+    def observe(self, request, response, started):
+        match = getattr(request, "resolver_match", None)
+        metrics.request_duration.observe(
+            time.perf_counter() - started,
+            match.url_name if match is not None and match.url_name else "unresolved",
+            request.method if request.method in METHODS else "OTHER",
+            response.status_code,
+        )
+        metrics.registry.maybe_flush()
+        return response
+
+
+class ReplicaMiddleware(HybridMiddleware):
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.pin(state, response)
+
+    async def __acall__(self, request):
+        # Offloaded views run in a copy of this task's context, which holds the same RequestState
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.pin(state, response)
+
+    def start(self, request):
+        state = RequestState(request, pinned=settings.DATABASE_REPLICA_PIN_COOKIE in request.COOKIES)
+        return state, current_request.set(state)
+
+    def pin(self, state, response):
+        cookie = settings.DATABASE_REPLICA_PIN_COOKIE
+        # Replicas lag behind, so for a few seconds after a write the client reads its own writes from the primary
+        if state.wrote and settings.DATABASE_REPLICAS:
+            max_age = settings.DATABASE_REPLICA_PIN_SECONDS
+            response.set_cookie(cookie, "1", max_age=max_age, httponly=True, samesite="Lax")
+        return response
+
+
+# Opt-in with PROFILING_ENABLED: every response gets a Server-Timing header, one in PROFILING_SAMPLE_RATE
+# requests is also run under cProfile and dumped to PROFILING_DIR
+class ProfilingMiddleware(HybridMiddleware):
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        profiling.install()
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = profiling.Profile()
+        token = profiling.current_profile.set(profile)
+        # Only sees the calling thread, so views offloaded to the async pool show up as a wait
+        profiler = cProfile.Profile() if random.random() < settings.PROFILING_SAMPLE_RATE else None
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            profiling.current_profile.reset(token)
+        return self.report(request, response, profile, profiler, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        # Offloaded views record into the same Profile through the copied context. No cProfile sampling here:
+        # the event loop interleaves other requests with this one.
+        profile = profiling.Profile()
+        token = profiling.current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.current_profile.reset(token)
+        return self.report(request, response, profile, None, time.perf_counter() - started)
+
+    def report(self, request, response, profile, profiler, total):
+        response["Server-Timing"] = profiling.server_timing(profile, total)
+        for sql, count in profile.repeated.items():
+            if count >= settings.PROFILING_REPEAT_THRESHOLD:
+                logger.warning("%s %s ran the same query %d times: %s", request.method, request.path, count, sql)
+        if profiler is not None:
+            self.dump(request, profiler, total)
+        return response
+
+    def dump(self, request, profiler, total):
+        match = getattr(request, "resolver_match", None)
+        name = match.url_name if match is not None and match.url_name else "unresolved"
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        path = os.path.join(
+            settings.PROFILING_DIR,
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{request.method}-{os.getpid()}-{total * 1000:.0f}ms.prof",
+        )
+        profiler.dump_stats(path)
+        logger.info("Profile of %s %s written to %s", request.method, request.path, path)
@@ -1,40 +1,40 @@
-# Generated by Django 3.1.2 on 2020-10-20 15:46
-
-import core.models
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    initial = True
-
-    dependencies = [
-        ('auth', '0012_alter_user_first_name_max_length'),
-    ]
-
-    operations = [
-        migrations.CreateModel(
-            name='User',
-            fields=[
-                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
-                ('password', models.CharField(max_length=128, verbose_name='password')),
-                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
-                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
-                ('full_name', models.CharField(max_length=255, verbose_name='ФИО')),
-                ('email', models.EmailField(max_length=254, unique=True, verbose_name='Email')),
-                ('email_confirmed', models.BooleanField(default=False, verbose_name='Email подтвержден')),
-                ('date_joined', models.DateTimeField(auto_now_add=True, verbose_name='Зарегистрирован')),
-                ('is_active', models.BooleanField(default=True, verbose_name='Активный')),
-                ('is_staff', models.BooleanField(default=False, verbose_name='Сотрудник')),
-                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.Group', verbose_name='groups')),
-                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.Permission', verbose_name='user permissions')),
-            ],
-            options={
-                'verbose_name': 'Пользователь',
-                'db_table': 'user',
-            },
-            managers=[
-                ('objects', core.models.UserManager()),
-            ],
-        ),
-    ]
+# Generated by Django 3.1.2 on 2020-10-20 15:46
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('full_name', models.CharField(max_length=255, verbose_name='ФИО')),
+                ('email', models.EmailField(max_length=254, unique=True, verbose_name='Email')),
+                ('email_confirmed', models.BooleanField(default=False, verbose_name='Email подтвержден')),
+                ('date_joined', models.DateTimeField(auto_now_add=True, verbose_name='Зарегистрирован')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активный')),
+                ('is_staff', models.BooleanField(default=False, verbose_name='Сотрудник')),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.Group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.Permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'Пользователь',
+                'db_table': 'user',
+            },
+            managers=[
+                ('objects', core.models.UserManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,82 @@
+import importlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+
+from celery_app import app
+from core.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, *args):
+    # Must run inside the caller's transaction, so the message exists exactly when its data does
+    return OutboxMessage.objects.create(task=task.name, args=list(args))
+
+
+# enqueue for many calls of one task, in batched INSERTs
+def enqueue_many(task, calls):
+    messages = [OutboxMessage(task=task.name, args=list(args)) for args in calls]
+    return OutboxMessage.objects.bulk_create(messages, batch_size=settings.OUTBOX_BATCH_SIZE)
+
+
+def is_processed(outbox_id):
+    return OutboxMessage.objects.filter(id=outbox_id, processed_at__isnull=False).exists()
+
+
+def mark_processed(*outbox_ids):
+    if outbox_ids:
+        OutboxMessage.objects.filter(id__in=outbox_ids).update(processed_at=timezone.now())
+
+
+def get_task(name):
+    # Task modules are imported by workers; a dispatcher started with --skip-checks may not have loaded them yet
+    if name not in app.tasks:
+        importlib.import_module(name.rpartition(".")[0])
+    return app.tasks[name]
+
+
+# At least once: rows are marked dispatched only after publishing, and dispatched rows no worker marked
+# processed within OUTBOX_REDELIVER_AFTER are published again. Tasks skip messages already processed.
+# A row published OUTBOX_MAX_ATTEMPTS times without being processed is marked failed and left for a look by hand.
+def dispatch_pending(batch_size=None):
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    stale = timezone.now() - timedelta(seconds=settings.OUTBOX_REDELIVER_AFTER)
+    pending = OutboxMessage.objects.filter(
+        Q(dispatched_at__isnull=True) | Q(dispatched_at__lt=stale), processed_at__isnull=True, failed_at__isnull=True
+    ).order_by("id")
+
+    with transaction.atomic():
+        # Concurrent dispatchers take disjoint batches where the database supports it
+        messages = list(pending.select_for_update(skip_locked=True)[:batch_size])
+        due = [message for message in messages if message.attempts < settings.OUTBOX_MAX_ATTEMPTS]
+        failed = [message.id for message in messages if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS]
+        if failed:
+            logger.error("Outbox messages %s not processed after %d attempts", failed, settings.OUTBOX_MAX_ATTEMPTS)
+            OutboxMessage.objects.filter(id__in=failed).update(failed_at=timezone.now())
+
+        published = []
+        try:
+            with app.producer_or_acquire() as producer:
+                for message in due:
+                    get_task(message.task).apply_async(
+                        message.args, {"outbox_id": message.id}, producer=producer
+                    )
+                    published.append(message.id)
+        except OperationalError:
+            logger.warning("Broker unavailable, %d outbox messages left pending", len(due) - len(published))
+        OutboxMessage.objects.filter(id__in=published).update(
+            dispatched_at=timezone.now(), attempts=F("attempts") + 1
+        )
+    return len(published)
+
+
+def purge_processed():
+    cutoff = timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION)
+    deleted, _ = OutboxMessage.objects.filter(processed_at__lt=cutoff).delete()
+    return deleted
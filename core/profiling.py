@@ -0,0 +1,118 @@
+import contextvars
+import functools
+import time
+from collections import Counter, defaultdict
+
+import redis
+from celery.signals import after_task_publish, before_task_publish
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class Profile:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.calls = Counter()
+        # Statements are keyed with placeholders, so the same query for different rows counts as a repeat
+        self.statements = Counter()
+        self.executions = Counter()
+        self.depth = Counter()
+        self.published = {}
+
+    def add(self, name, duration):
+        self.durations[name] += duration
+        self.calls[name] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.executions.values())
+
+    @property
+    def repeated(self):
+        return {sql: count for sql, count in self.statements.items() if count > 1}
+
+
+def timed(name, func):
+    # Only the outermost call is counted, serializers call each other through .data and friends
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None or profile.depth[name]:
+            return func(*args, **kwargs)
+        profile.depth[name] += 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.add(name, time.perf_counter() - started)
+            profile.depth[name] -= 1
+
+    return wrapper
+
+
+def record_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add("db", time.perf_counter() - started)
+        profile.statements[sql] += 1
+        if not many:
+            profile.executions[sql, repr(params)] += 1
+
+
+def add_query_wrapper(sender, connection, **kwargs):
+    # Every connection, from any thread, keeps the wrapper; it costs one lookup outside profiled requests
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def task_published(sender, headers=None, **kwargs):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.published[headers["id"]] = time.perf_counter()
+
+
+def task_sent(sender, headers=None, **kwargs):
+    profile = current_profile.get()
+    if profile is not None and headers["id"] in profile.published:
+        profile.add("celery", time.perf_counter() - profile.published.pop(headers["id"]))
+
+
+_installed = False
+
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    connection_created.connect(add_query_wrapper, dispatch_uid="core.profiling")
+    for connection in connections.all():
+        add_query_wrapper(sender=None, connection=connection)
+    before_task_publish.connect(task_published, dispatch_uid="core.profiling", weak=False)
+    after_task_publish.connect(task_sent, dispatch_uid="core.profiling", weak=False)
+
+    redis.Redis.execute_command = timed("redis", redis.Redis.execute_command)
+    redis.client.Pipeline.execute = timed("redis", redis.client.Pipeline.execute)
+    BaseSerializer.is_valid = timed("serializer", BaseSerializer.is_valid)
+    BaseSerializer.data = property(timed("serializer", BaseSerializer.data.fget))
+
+
+def server_timing(profile, total):
+    queries = profile.calls["db"]
+    metrics = [
+        f"total;dur={total * 1000:.1f}",
+        f'db;dur={profile.durations["db"] * 1000:.1f};desc="{queries} queries, {profile.duplicates} duplicates"',
+    ]
+    for name in ["serializer", "redis", "celery"]:
+        if profile.calls[name]:
+            metrics.append(f'{name};dur={profile.durations[name] * 1000:.1f};desc="{profile.calls[name]} calls"')
+    return ", ".join(metrics)
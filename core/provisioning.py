@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from core.models import User
+from core.outbox import enqueue_many
+from core.serializers import UserProvisionSerializer
+from core.tasks import send_email_with_confirm
+
+
+def password_pool(workers):
+    # PBKDF2 is CPU bound, so it goes to processes; django.setup() covers platforms that spawn
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=django.setup)
+
+
+# Hashes on the given pool, or on one started for this call; callers hashing several batches pass their own
+def hash_passwords(passwords, workers, pool=None):
+    workers = workers or os.cpu_count()
+    if workers <= 1 or len(passwords) <= 1:
+        return [make_password(password) for password in passwords]
+
+    if pool is None:
+        with password_pool(workers) as pool:
+            return hash_passwords(passwords, workers, pool)
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+
+# Invalid rows are reported by index and skipped, the rest are inserted in one transaction
+def provision_users(rows, workers=1, send_emails=False, pool=None):
+    serializer = UserProvisionSerializer()
+    valid, errors, emails = {}, {}, set()
+
+    for index, row in enumerate(rows):
+        try:
+            attrs = serializer.run_validation(row)
+        except ValidationError as exc:
+            errors[index] = exc.detail
+            continue
+
+        attrs["email"] = User.objects.normalize_email(attrs["email"])
+        if attrs["email"] in emails:
+            errors[index] = {"email": ["Повторяющийся email."]}
+            continue
+        emails.add(attrs["email"])
+        valid[index] = attrs
+
+    existing = set(User.objects.filter(email__in=emails).values_list("email", flat=True))
+    for index, attrs in list(valid.items()):
+        if attrs["email"] in existing:
+            errors[index] = {"email": ["Данный email уже зарегистрирован."]}
+            del valid[index]
+
+    passwords = hash_passwords([attrs.pop("password") for attrs in valid.values()], workers, pool)
+    users = [User(password=password, **attrs) for attrs, password in zip(valid.values(), passwords)]
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=settings.USER_PROVISION_BATCH_SIZE)
+        if send_emails:
+            # Published by the outbox dispatcher once this commits, as for registration
+            enqueue_many(send_email_with_confirm, [(user.email,) for user in users])
+
+    return users, errors
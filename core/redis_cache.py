@@ -0,0 +1,10 @@
+from django_redis.pool import ConnectionFactory
+
+from core.redis_client import instrument
+
+
+# The cache builds its own clients; they are instrumented the same way as those from core.redis_client
+class InstrumentedConnectionFactory(ConnectionFactory):
+    def connect(self, url):
+        instrument()
+        return super().connect(url)
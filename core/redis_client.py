@@ -0,0 +1,35 @@
+import threading
+
+from django.conf import settings
+
+from core import metrics
+
+_pools = {}
+_lock = threading.Lock()
+_instrumented = False
+
+
+# Redis commands are timed from where the clients are built
+def instrument():
+    global _instrumented
+    # Imported here as well: Celery workers and commands load this module but may never need Redis
+    import redis
+
+    if not _instrumented:
+        with _lock:
+            if not _instrumented:
+                metrics.instrument_redis(redis)
+                _instrumented = True
+    return redis
+
+
+# Clients share one connection pool per database, created on first use rather than at import
+def get_redis(db):
+    redis = instrument()
+    pool = _pools.get(db)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(db)
+            if pool is None:
+                pool = _pools[db] = redis.ConnectionPool(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=db)
+    return redis.Redis(connection_pool=pool)
@@ -0,0 +1,93 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RequestState:
+    # Mutable on purpose: a view offloaded to a thread runs in a copy of the context but pins this same object
+    def __init__(self, request, pinned=False):
+        self.request = request
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def is_pinned():
+    state = current_request.get()
+    return state is not None and state.pinned
+
+
+def read_from_replica():
+    state = current_request.get()
+    return state is not None and state.replica not in (None, DEFAULT_DB_ALIAS)
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def is_healthy(alias):
+    now = time.monotonic()
+    healthy, checked = _health.get(alias, (False, None))
+    if checked is not None and now - checked < settings.DATABASE_REPLICA_HEALTH_INTERVAL:
+        return healthy
+
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1")
+        healthy = True
+    except DatabaseError:
+        logger.warning("Replica %s is unavailable, reading from the primary", alias, exc_info=True)
+        healthy = False
+    with _health_lock:
+        _health[alias] = (healthy, now)
+    return healthy
+
+
+def choose_replica():
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if is_healthy(alias)]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+# Replicas only serve the safe requests of DATABASE_REPLICA_VIEWS; everything else, and every query after
+# a write in the same request, goes to the primary
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = current_request.get()
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+
+        match = getattr(state.request, "resolver_match", None)
+        if match is None or match.url_name not in settings.DATABASE_REPLICA_VIEWS:
+            return DEFAULT_DB_ALIAS
+        if state.request.method not in SAFE_METHODS:
+            return DEFAULT_DB_ALIAS
+
+        # One replica per request, so all of its reads come from the same snapshot
+        if state.replica is None:
+            state.replica = choose_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current_request.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
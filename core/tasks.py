@@ -1,30 +1,81 @@
-import random
-
-import redis
-from django.conf import settings
-from django.core import mail
-
-from celery_app import app
-
-r = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=2)
-
-
-@app.task
-def send_email_with_confirm(email):
-    code = str(random.randint(100000, 999999))
-
-    data = f"""
-    Рады приветствовать на нашем сайте!
-    Проверочный код для подтверждения регистрации (действителен в течении 24 часов):
-    <b>{code}</b>
-    """
-
-    mail.send_mail(
-        "Письмо с подтверждением регистрации",
-        data,
-        settings.DEFAULT_FROM_EMAIL,
-        [email],
-        fail_silently=False,
-    )
-
-    r.set(email, code, ex=60 * 60 * 24)
+import json
+import logging
+import random
+import smtplib
+
+from django.conf import settings
+from django.core import mail
+
+from celery_app import app
+from core.codes import get_code_store
+from core.outbox import is_processed, mark_processed
+
+logger = logging.getLogger(__name__)
+
+
+def build_confirmation_email(email, code):
+    data = f"""
+    Рады приветствовать на нашем сайте!
+    Проверочный код для подтверждения регистрации (действителен в течении 24 часов):
+    <b>{code}</b>
+    """
+    return mail.EmailMessage("Письмо с подтверждением регистрации", data, settings.DEFAULT_FROM_EMAIL, [email])
+
+
+def deliver_confirmations(emails):
+    # One SMTP connection for the whole batch; returns {email: error} for the messages that failed
+    codes = {email: str(random.randint(100000, 999999)) for email in emails}
+    failed = {}
+    # Stored before sending: a recipient early in a large batch may confirm before the batch is through
+    store = get_code_store()
+    store.set_many(codes)
+
+    with mail.get_connection(fail_silently=False) as connection:
+        for email, code in codes.items():
+            try:
+                connection.open()
+                connection.send_messages([build_confirmation_email(email, code)])
+            except (smtplib.SMTPException, OSError) as exc:
+                logger.warning("Confirmation email to %s failed: %s", email, exc)
+                failed[email] = str(exc)
+                # Reconnect for the next message in case this one broke the session
+                connection.close()
+
+    if failed:
+        store.delete_many(list(failed))
+    return failed
+
+
+def parse_pending(entry):
+    # Entries queued without an outbox message are bare emails
+    if not entry.startswith("["):
+        return entry, None
+    email, outbox_id = json.loads(entry)
+    return email, outbox_id
+
+
+@app.task
+def send_email_with_confirm(email, outbox_id=None):
+    # Outbox messages may be delivered more than once; one already handled is not queued again
+    if outbox_id is not None and is_processed(outbox_id):
+        return
+
+    # Queued for the next batch, flushed when it is full or by the periodic flush. The outbox message is only
+    # marked processed once the email is out, so the outbox redelivers emails lost with a batch or refused by SMTP.
+    entry = json.dumps([email, outbox_id]) if outbox_id is not None else email
+    if get_code_store().push_pending(entry) >= settings.CONFIRM_EMAIL_BATCH_SIZE:
+        flush_confirmation_emails.delay()
+
+
+@app.task
+def flush_confirmation_emails():
+    entries, remaining = get_code_store().pop_pending(settings.CONFIRM_EMAIL_BATCH_SIZE)
+    if remaining >= settings.CONFIRM_EMAIL_BATCH_SIZE:
+        flush_confirmation_emails.delay()
+    if not entries:
+        return {}
+
+    pending = [parse_pending(entry) for entry in entries]
+    failed = deliver_confirmations([email for email, _ in pending])
+    mark_processed(*(outbox_id for email, outbox_id in pending if outbox_id is not None and email not in failed))
+    return failed
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.throttling import ScopedRateThrottle
+
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_limiter = None
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = import_string(settings.RATE_LIMITER)()
+    return _limiter
+
+
+@receiver(setting_changed)
+def reset_rate_limiter(setting, **kwargs):
+    global _limiter
+    if setting == "RATE_LIMITER":
+        _limiter = None
+
+
+# Token buckets: each key holds up to `capacity` tokens and regains `capacity` per `duration` seconds.
+# A request takes one token from every key, or from none of them if any bucket is empty.
+class LocalRateLimiter:
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, keys, capacity, duration, now=None):
+        now = time.time() if now is None else now
+        rate = capacity / duration
+        with self.lock:
+            tokens = []
+            wait = 0
+            for key in keys:
+                stored, updated = self.buckets.get(key, (capacity, now))
+                available = min(capacity, stored + (now - updated) * rate)
+                tokens.append(available)
+                if available < 1:
+                    wait = max(wait, (1 - available) / rate)
+            if wait:
+                return False, wait
+
+            for key, available in zip(keys, tokens):
+                self.buckets[key] = (available - 1, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > settings.RATE_LIMIT_LOCAL_SIZE:
+                self.buckets.popitem(last=False)
+            return True, 0
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class RedisRateLimiter:
+    # Same algorithm as LocalRateLimiter, checked and applied for every key in one round trip.
+    # Floats are returned as strings, Redis would truncate Lua numbers to integers.
+    HIT_SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local rate = capacity / tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local tokens = {}
+        local wait = 0
+        for i, key in ipairs(KEYS) do
+            local state = redis.call("HMGET", key, "tokens", "updated")
+            local stored = tonumber(state[1]) or capacity
+            local updated = tonumber(state[2]) or now
+            tokens[i] = math.min(capacity, stored + (now - updated) * rate)
+            if tokens[i] < 1 then
+                wait = math.max(wait, (1 - tokens[i]) / rate)
+            end
+        end
+        if wait > 0 then
+            return tostring(wait)
+        end
+        for i, key in ipairs(KEYS) do
+            redis.call("HSET", key, "tokens", tostring(tokens[i] - 1), "updated", ARGV[3])
+            redis.call("EXPIRE", key, ARGV[2])
+        end
+        return "0"
+    """
+
+    def __init__(self):
+        self.redis = get_redis(settings.RATE_LIMIT_REDIS_DB)
+        self.hit_script = self.redis.register_script(self.HIT_SCRIPT)
+        self.fallback = LocalRateLimiter()
+        self.unavailable_until = 0
+
+    def hit(self, keys, capacity, duration, now=None):
+        now = time.time() if now is None else now
+        # While Redis is down every process limits on its own instead of letting the flood through
+        if now < self.unavailable_until:
+            return self.fallback.hit(keys, capacity, duration, now)
+        try:
+            wait = float(self.hit_script(keys=keys, args=[capacity, duration, repr(now)]))
+        except redis.RedisError:
+            logger.warning("Redis is unavailable, rate limiting in process", exc_info=True)
+            self.unavailable_until = now + settings.RATE_LIMIT_RETRY_INTERVAL
+            return self.fallback.hit(keys, capacity, duration, now)
+        return not wait, wait
+
+
+# Runs in APIView.initial(), so rejected requests never reach password hashing or the database.
+# Every request is counted against the client address and, when known, the email it targets.
+class PasswordHashingThrottle(ScopedRateThrottle):
+    def get_rate(self):
+        return settings.RATE_LIMITS.get(self.scope)
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        self.rate = self.get_rate() if self.scope else None
+        if self.rate is None:
+            return True
+
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        allowed, self.wait_seconds = get_rate_limiter().hit(
+            self.get_keys(request), self.num_requests, self.duration, self.timer()
+        )
+        return allowed
+
+    def get_keys(self, request):
+        keys = [self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}]
+        email = self.get_email(request)
+        if email:
+            keys.append(self.cache_format % {"scope": self.scope, "ident": email})
+        return keys
+
+    def get_email(self, request):
+        if request.user.is_authenticated:
+            return request.user.email.lower()
+        email = request.data.get("email") if hasattr(request.data, "get") else None
+        return email.strip().lower() if isinstance(email, str) else None
+
+    def wait(self):
+        return self.wait_seconds
@@ -1,13 +1,18 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
-from core.views import RegistrationView, ProfileView, ChangePasswordView, EmailConfirmView
+from core.views import (
+    RegistrationView, ProfileView, TokenObtainView, ChangePasswordView, EmailConfirmView, UserProvisionView,
+    metrics_view,
+)
 
 urlpatterns = [
     path("auth/registration/", RegistrationView.as_view(), name="registration"),
     path("profile/", ProfileView.as_view(), name="profile"),
-    path("token/", TokenObtainPairView.as_view(), name="token-obtain-pair"),
+    path("token/", TokenObtainView.as_view(), name="token-obtain-pair"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token-refresh"),
     path("change-password/", ChangePasswordView.as_view(), name="change-password"),
     path("email/confirm/", EmailConfirmView.as_view(), name="email-confirm"),
+    path("users/provision/", UserProvisionView.as_view(), name="user-provision"),
+    path("metrics", metrics_view, name="metrics"),
 ]
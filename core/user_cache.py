@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import User
+
+
+# Cached user rows for CachedJWTAuthentication, kept apart from it so invalidation works without DRF loaded
+class LocalCache:
+    # Small per-process LRU with a TTL; entries are plain tuples so callers never share a model instance
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + settings.AUTH_USER_LOCAL_CACHE_TIMEOUT, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.AUTH_USER_LOCAL_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache()
+
+# What authentication, permissions and throttling read; the password hash and the rest stay deferred and are
+# loaded from the database if a view needs them. Kept in model order, as Model.from_db expects.
+CACHED_FIELDS = {"email", "full_name", "email_confirmed", "is_active", "is_staff", "is_superuser"}
+FIELDS = [field.attname for field in User._meta.concrete_fields if field.primary_key or field.name in CACHED_FIELDS]
+
+
+def cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def get_cache():
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    # Imported here, simplejwt loads DRF, which workers and commands that save users don't otherwise need
+    from rest_framework_simplejwt.settings import api_settings
+
+    key = cache_key(getattr(instance, api_settings.USER_ID_FIELD))
+    # After commit, so a request in between can't cache the row as it was before the write
+    transaction.on_commit(lambda: delete_user(key), using=kwargs.get("using"))
+
+
+def delete_user(key):
+    local_cache.delete(key)
+    get_cache().delete(key)
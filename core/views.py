@@ -1,32 +1,77 @@
-from rest_framework import generics
-from rest_framework.permissions import AllowAny
-from rest_framework_simplejwt.authentication import JWTAuthentication
-
-from core.serializers import RegistrationSerializer, ProfileSerializer, ChangePasswordSerializer, EmailConfirmSerializer
-
-
-class RegistrationView(generics.CreateAPIView):
-    serializer_class = RegistrationSerializer
-    permission_classes = [AllowAny]
-
-
-class ProfileView(generics.RetrieveUpdateAPIView):
-    serializer_class = ProfileSerializer
-    authentication_classes = (JWTAuthentication,)
-
-    def get_object(self):
-        return self.request.user
-
-
-class ChangePasswordView(generics.UpdateAPIView):
-    serializer_class = ChangePasswordSerializer
-
-    def get_object(self):
-        return self.request.user
-
-
-class EmailConfirmView(generics.UpdateAPIView):
-    serializer_class = EmailConfirmSerializer
-
-    def get_object(self):
-        return self.request.user
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import generics, status
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from core.authentication import CachedJWTAuthentication
+from core.metrics import registry
+from core.provisioning import provision_users
+from core.serializers import RegistrationSerializer, ProfileSerializer, ChangePasswordSerializer, EmailConfirmSerializer
+from core.throttling import PasswordHashingThrottle
+
+
+class RegistrationView(generics.CreateAPIView):
+    serializer_class = RegistrationSerializer
+    permission_classes = [AllowAny]
+    throttle_classes = [PasswordHashingThrottle]
+    throttle_scope = "registration"
+
+
+class TokenObtainView(TokenObtainPairView):
+    throttle_classes = [PasswordHashingThrottle]
+    throttle_scope = "token"
+
+
+class ProfileView(generics.RetrieveUpdateAPIView):
+    serializer_class = ProfileSerializer
+    authentication_classes = (CachedJWTAuthentication,)
+
+    def get_object(self):
+        return self.request.user
+
+
+class ChangePasswordView(generics.UpdateAPIView):
+    serializer_class = ChangePasswordSerializer
+    throttle_classes = [PasswordHashingThrottle]
+    throttle_scope = "change-password"
+
+    def get_object(self):
+        return self.request.user
+
+
+class EmailConfirmView(generics.UpdateAPIView):
+    serializer_class = EmailConfirmSerializer
+
+    def get_object(self):
+        return self.request.user
+
+
+class UserProvisionView(generics.GenericAPIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        limit = settings.USER_PROVISION_MAX_ITEMS
+        if not isinstance(request.data, list) or len(request.data) > limit:
+            return Response(
+                {"non_field_errors": [f"Ожидался список не более чем из {limit} элементов."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        users, errors = provision_users(
+            request.data,
+            workers=settings.USER_PROVISION_WORKERS,
+            send_emails=request.query_params.get("send_emails") == "1",
+        )
+        code = status.HTTP_201_CREATED if users or not errors else status.HTTP_400_BAD_REQUEST
+        return Response({"created": [user.email for user in users], "errors": errors}, status=code)
+
+
+# Plain Django view: Prometheus scrapes it often and needs none of DRF's negotiation
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
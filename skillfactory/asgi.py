@@ -1,16 +1,22 @@
-"""
-ASGI config for skillfactory project.
-
-It exposes the ASGI callable as a module-level variable named ``application``.
-
-For more information on this file, see
-https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
-"""
-
-import os
-
-from django.core.asgi import get_asgi_application
-
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "skillfactory.settings")
-
-application = get_asgi_application()
+"""
+ASGI config for skillfactory project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "skillfactory.settings")
+os.environ.setdefault("BOOKS_ASYNC_VIEWS", "1")
+
+# As get_asgi_application(), with a handler that streams responses off the event loop
+django.setup(set_prefix=False)
+
+from core.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
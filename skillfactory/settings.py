@@ -1,141 +1,280 @@
-"""
-Django settings for skillfactory project.
-
-Generated by 'django-admin startproject' using Django 3.1.1.
-
-For more information on this file, see
-https://docs.djangoproject.com/en/3.1/topics/settings/
-
-For the full list of settings and their values, see
-https://docs.djangoproject.com/en/3.1/ref/settings/
-"""
-
-from pathlib import Path
-
-# Build paths inside the project like this: BASE_DIR / 'subdir'.
-BASE_DIR = Path(__file__).resolve().parent.parent
-
-
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
-
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "n68)1ka_2ds4fj5w+9p)p&o_)k*9b0zbag4z2guowyt#2)bp@2"
-
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
-
-ALLOWED_HOSTS = ["*"]
-CORS_ALLOW_ALL_ORIGINS = True
-
-# Application definition
-
-INSTALLED_APPS = [
-    "django.contrib.admin",
-    "django.contrib.auth",
-    "django.contrib.contenttypes",
-    "django.contrib.sessions",
-    "django.contrib.messages",
-    "django.contrib.staticfiles",
-
-    "rest_framework",
-    "corsheaders",
-
-    "core",
-    "books",
-]
-
-MIDDLEWARE = [
-    "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
-    "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
-]
-
-ROOT_URLCONF = "skillfactory.urls"
-
-TEMPLATES = [
-    {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
-        "DIRS": [],
-        "APP_DIRS": True,
-        "OPTIONS": {
-            "context_processors": [
-                "django.template.context_processors.debug",
-                "django.template.context_processors.request",
-                "django.contrib.auth.context_processors.auth",
-                "django.contrib.messages.context_processors.messages",
-            ],
-        },
-    },
-]
-
-WSGI_APPLICATION = "skillfactory.wsgi.application"
-
-
-# Database
-# https://docs.djangoproject.com/en/3.1/ref/settings/#databases
-
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
-}
-
-
-# Password validation
-# https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
-
-AUTH_PASSWORD_VALIDATORS = [
-    {
-        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
-    },
-    {
-        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
-    },
-    {
-        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
-    },
-    {
-        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
-    },
-]
-
-AUTH_USER_MODEL = "core.User"
-
-REST_FRAMEWORK = {
-    "DEFAULT_PERMISSION_CLASSES": (
-        "rest_framework.permissions.IsAuthenticated",
-    ),
-    "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    ),
-}
-
-# Internationalization
-# https://docs.djangoproject.com/en/3.1/topics/i18n/
-
-LANGUAGE_CODE = "ru-ru"
-
-TIME_ZONE = "Europe/Moscow"
-
-USE_I18N = True
-
-USE_L10N = True
-
-USE_TZ = True
-
-
-# Static files (CSS, JavaScript, Images)
-# https://docs.djangoproject.com/en/3.1/howto/static-files/
-
-STATIC_URL = "/static/"
-
-# Celery
-REDIS_HOST = "127.0.0.1"
-REDIS_PORT = 6379
-CELERY_BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
+"""
+Django settings for skillfactory project.
+
+Generated by 'django-admin startproject' using Django 3.1.1.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/3.1/ref/settings/
+"""
+
+import os
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = "n68)1ka_2ds4fj5w+9p)p&o_)k*9b0zbag4z2guowyt#2)bp@2"
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+ALLOWED_HOSTS = ["*"]
+CORS_ALLOW_ALL_ORIGINS = True
+
+# Application definition
+
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+
+    "rest_framework",
+    "corsheaders",
+
+    "core.apps.CoreConfig",
+    "books.apps.BooksConfig",
+]
+
+# DJANGO_FAST_BOOT=1 for Celery workers and short-lived management commands: apps only the web process
+# uses are left out (don't run migrate this way). Pass --skip-checks to commands as well, the URL checks
+# would import every view and with them DRF. `python -X importtime` shows where the remaining time goes.
+FAST_BOOT = os.environ.get("DJANGO_FAST_BOOT") == "1"
+WEB_ONLY_APPS = {
+    "django.contrib.admin",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "rest_framework",
+    "corsheaders",
+}
+if FAST_BOOT:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in WEB_ONLY_APPS]
+
+MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ProfilingMiddleware",
+    "core.middleware.ReplicaMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+ROOT_URLCONF = "skillfactory.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [],
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.debug",
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = "skillfactory.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/3.1/ref/settings/#databases
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    }
+}
+
+# Read replicas for the safe requests of DATABASE_REPLICA_VIEWS. Locally DATABASE_REPLICA_COUNT=2 uses
+# copies of db.sqlite3 (db.replica_1.sqlite3, ...) as stand-ins; tests read them through the primary.
+DATABASE_REPLICA_COUNT = int(os.environ.get("DATABASE_REPLICA_COUNT", 0))
+DATABASE_REPLICAS = [f"replica_{number}" for number in range(1, DATABASE_REPLICA_COUNT + 1)]
+DATABASES.update({
+    alias: {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    }
+    for alias in DATABASE_REPLICAS
+})
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+DATABASE_REPLICA_VIEWS = {"book-list", "book-detail", "profile"}
+DATABASE_REPLICA_HEALTH_INTERVAL = 10
+DATABASE_REPLICA_PIN_COOKIE = "db_pin"
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+
+# Password validation
+# https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+AUTH_USER_MODEL = "core.User"
+
+REST_FRAMEWORK = {
+    "DEFAULT_PERMISSION_CLASSES": (
+        "rest_framework.permissions.IsAuthenticated",
+    ),
+    "DEFAULT_AUTHENTICATION_CLASSES": (
+        "core.authentication.CachedJWTAuthentication",
+    ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "core.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "core.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
+    # Proxies in front of the app, e.g. 1 behind a load balancer. Throttling identifies clients by the
+    # X-Forwarded-For entry the last proxy added; with 0 it uses REMOTE_ADDR and ignores the header.
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
+}
+
+# Profiling, off unless PROFILING_ENABLED=1: Server-Timing headers with query, serializer, Redis and Celery
+# time, a warning for queries repeated PROFILING_REPEAT_THRESHOLD times (N+1), and a cProfile dump for
+# a PROFILING_SAMPLE_RATE share of requests (view with `python -m pstats <file>`)
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED") == "1"
+PROFILING_SAMPLE_RATE = 0.001
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_REPEAT_THRESHOLD = 10
+
+# Prometheus metrics at /metrics. Processes of one host share their counts through snapshot files in
+# METRICS_DIR, written every METRICS_FLUSH_INTERVAL seconds; clear it on deploy. Unset, only the serving
+# process is reported. With METRICS_TOKEN set, scrapes need "Authorization: Bearer <token>".
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Internationalization
+# https://docs.djangoproject.com/en/3.1/topics/i18n/
+
+LANGUAGE_CODE = "ru-ru"
+
+TIME_ZONE = "Europe/Moscow"
+
+USE_I18N = True
+
+USE_L10N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/3.1/howto/static-files/
+
+STATIC_URL = "/static/"
+
+# Celery
+REDIS_HOST = "127.0.0.1"
+REDIS_PORT = 6379
+CELERY_BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
+CELERY_BEAT_SCHEDULE = {
+    "flush-confirmation-emails": {
+        "task": "core.tasks.flush_confirmation_emails",
+        "schedule": 5.0,
+    },
+}
+
+# Transactional outbox, published by `manage.py dispatch_outbox`; dispatched messages not processed within
+# OUTBOX_REDELIVER_AFTER seconds are published again, processed ones are deleted after OUTBOX_RETENTION.
+# Messages published OUTBOX_MAX_ATTEMPTS times without being processed are marked failed and no longer published.
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_INTERVAL = 0.5
+OUTBOX_REDELIVER_AFTER = 10 * 60
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETENTION = 7 * 24 * 60 * 60
+
+# Confirmation codes; core.codes.InMemoryCodeStore runs without Redis
+CONFIRM_CODE_STORE = "core.codes.RedisCodeStore"
+CONFIRM_CODE_REDIS_DB = 2
+CONFIRM_CODE_TTL = 60 * 60 * 24
+
+# Confirmation emails are sent in batches of up to this size, at least every 5 seconds (see CELERY_BEAT_SCHEDULE)
+CONFIRM_EMAIL_BATCH_SIZE = 100
+
+# Rate limits for endpoints that hash passwords, per client address and per email;
+# core.throttling.LocalRateLimiter keeps the counters in process
+RATE_LIMITER = "core.throttling.RedisRateLimiter"
+RATE_LIMIT_REDIS_DB = 3
+RATE_LIMIT_RETRY_INTERVAL = 30
+RATE_LIMIT_LOCAL_SIZE = 100000
+RATE_LIMITS = {
+    "registration": "10/m",
+    "token": "20/m",
+    "change-password": "5/m",
+}
+
+# Cache
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/1",
+    },
+}
+DJANGO_REDIS_CONNECTION_FACTORY = "core.redis_cache.InstrumentedConnectionFactory"
+
+# Authentication
+AUTH_USER_CACHE_ALIAS = "default"
+AUTH_USER_CACHE_TIMEOUT = 5 * 60
+# Other processes only see a password change or deactivation once their local copy expires
+AUTH_USER_LOCAL_CACHE_TIMEOUT = 5
+AUTH_USER_LOCAL_CACHE_SIZE = 10000
+
+# Bulk user provisioning; None hashes passwords on every CPU
+USER_PROVISION_WORKERS = None
+USER_PROVISION_BATCH_SIZE = 1000
+USER_PROVISION_MAX_ITEMS = 5000
+
+# Books
+BOOKS_BULK_BATCH_SIZE = 1000
+BOOKS_BULK_MAX_ITEMS = 50000
+BOOKS_BATCH_MAX_IDS = 100
+BOOKS_CACHE_ALIAS = "default"
+BOOKS_CACHE_TIMEOUT = 60 * 60
+BOOKS_CACHE_LOCK_TIMEOUT = 10
+BOOKS_CACHE_LOCK_WAIT = 2
+BOOKS_EXPORT_CHUNK_SIZE = 2000
+BOOKS_IMPORT_BATCH_SIZE = 5000
+# /books/changes/: ?wait= long-polls up to BOOKS_CHANGES_MAX_WAIT seconds, checking every POLL_INTERVAL
+BOOKS_CHANGES_PAGE_SIZE = 100
+BOOKS_CHANGES_MAX_PAGE_SIZE = 1000
+BOOKS_CHANGES_MAX_WAIT = 30
+BOOKS_CHANGES_POLL_INTERVAL = 0.5
+# Set by skillfactory.asgi: book handlers become native async views backed by a thread pool
+BOOKS_ASYNC_VIEWS = os.environ.get("BOOKS_ASYNC_VIEWS") == "1"
+BOOKS_ASYNC_MAX_WORKERS = 32
@@ -1,24 +1,28 @@
-"""skillfactory URL Configuration
-
-The `urlpatterns` list routes URLs to views. For more information please see:
-    https://docs.djangoproject.com/en/3.1/topics/http/urls/
-Examples:
-Function views
-    1. Add an import:  from my_app import views
-    2. Add a URL to urlpatterns:  path('', views.home, name='home')
-Class-based views
-    1. Add an import:  from other_app.views import Home
-    2. Add a URL to urlpatterns:  path('', Home.as_view(), name='home')
-Including another URLconf
-    1. Import the include() function: from django.urls import include, path
-    2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
-"""
-from django.contrib import admin
-from django.urls import include, path
-
-
-urlpatterns = [
-    path("admin/", admin.site.urls),
-    path("books/", include("books.urls")),
-    path("", include("core.urls")),
-]
+"""skillfactory URL Configuration
+
+The `urlpatterns` list routes URLs to views. For more information please see:
+    https://docs.djangoproject.com/en/3.1/topics/http/urls/
+Examples:
+Function views
+    1. Add an import:  from my_app import views
+    2. Add a URL to urlpatterns:  path('', views.home, name='home')
+Class-based views
+    1. Add an import:  from other_app.views import Home
+    2. Add a URL to urlpatterns:  path('', Home.as_view(), name='home')
+Including another URLconf
+    1. Import the include() function: from django.urls import include, path
+    2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
+"""
+from django.apps import apps
+from django.contrib import admin
+from django.urls import include, path
+
+
+urlpatterns = [
+    path("books/", include("books.urls")),
+    path("", include("core.urls")),
+]
+
+# Left out of INSTALLED_APPS under DJANGO_FAST_BOOT, see settings
+if apps.is_installed("django.contrib.admin"):
+    urlpatterns.insert(0, path("admin/", admin.site.urls))
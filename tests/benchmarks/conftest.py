@@ -0,0 +1,110 @@
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from books.models import Author, Book
+
+# Configured through the environment so plain `pytest -m benchmark` and `manage.py bench` behave the same
+SIZES = [int(size) for size in os.environ.get("BENCH_SIZES", "1000,100000,1000000").split(",")]
+USERS = int(os.environ.get("BENCH_USERS", 10000))
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", 50))
+THRESHOLD = float(os.environ.get("BENCH_THRESHOLD", 0.25))
+BASELINE = Path(os.environ.get("BENCH_BASELINE", Path(__file__).with_name("baseline.json")))
+RESULTS = Path(os.environ.get("BENCH_RESULTS", Path(__file__).with_name("results.json")))
+SAVE_BASELINE = os.environ.get("BENCH_SAVE_BASELINE") == "1"
+
+
+def seed_books(total, batch_size=5000):
+    authors = Author.objects.resolve(f"Автор {i}" for i in range(5000))
+    for start in range(Book.objects.count(), total, batch_size):
+        numbers = range(start, min(start + batch_size, total))
+        Book.objects.bulk_create(
+            [Book(author=authors[f"Автор {i % 5000}"], title=f"Книга номер {i}") for i in numbers]
+        )
+
+
+def percentile(quantiles, n):
+    return round(quantiles[n - 1] * 1000, 3)
+
+
+class Bench:
+    def __init__(self, baseline, results, capsys):
+        self.baseline = baseline
+        self.results = results
+        self.capsys = capsys
+
+    # Timed rounds run bare; queries and peak memory come from one extra call, since tracemalloc skews timings
+    def __call__(self, name, func, rounds=ROUNDS, setup=None):
+        timings = []
+        for i in range(rounds):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            func(i)
+            timings.append(time.perf_counter() - started)
+
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            func(rounds)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        quantiles = statistics.quantiles(timings, n=100, method="inclusive")
+        result = self.results[name] = {
+            "rounds": rounds,
+            "p50_ms": percentile(quantiles, 50),
+            "p95_ms": percentile(quantiles, 95),
+            "p99_ms": percentile(quantiles, 99),
+            "queries": len(queries),
+            "peak_kib": round(peak / 1024, 1),
+        }
+        with self.capsys.disabled():
+            print(
+                f"\n{name:<36} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  "
+                f"p99 {result['p99_ms']:>9.3f} ms  {result['queries']:>3} queries  {result['peak_kib']:>9.1f} KiB",
+                end="",
+            )
+
+        regressions = self.compare(name, result)
+        if regressions:
+            pytest.fail(f"{name} regressed: " + ", ".join(regressions), pytrace=False)
+        return result
+
+    def compare(self, name, result):
+        expected = self.baseline.get(name)
+        if SAVE_BASELINE or expected is None:
+            return []
+        regressions = []
+        for metric in ["p95_ms", "peak_kib"]:
+            if result[metric] > expected[metric] * (1 + THRESHOLD):
+                regressions.append(f"{metric} {expected[metric]} -> {result[metric]}")
+        # Query counts are exact, any increase is a regression
+        if result["queries"] > expected["queries"]:
+            regressions.append(f"queries {expected['queries']} -> {result['queries']}")
+        return regressions
+
+
+@pytest.fixture(scope="session")
+def bench_results():
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    results = {}
+    yield baseline, results
+
+    if results:
+        RESULTS.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        if SAVE_BASELINE:
+            BASELINE.write_text(json.dumps({**baseline, **results}, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def bench(bench_results, capsys):
+    return Bench(*bench_results, capsys)
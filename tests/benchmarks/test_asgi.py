@@ -0,0 +1,76 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.test import AsyncClient, Client
+from django.urls import path
+
+from books.models import Author, Book
+from books.views import BookList
+from books.views_async import offload
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+CLIENTS = 64
+WSGI_THREADS = 8
+# Stands in for a slow query or upstream call inside the handler
+DELAY = 0.02
+
+book_list = BookList.as_view()
+
+
+def slow_book_list(request):
+    time.sleep(DELAY)
+    return book_list(request)
+
+
+urlpatterns = [
+    path("sync/", slow_book_list),
+    path("async/", offload(slow_book_list)),
+]
+
+
+def wsgi():
+    def get(_):
+        return Client().get("/sync/").status_code
+
+    with ThreadPoolExecutor(max_workers=WSGI_THREADS) as pool:
+        return list(pool.map(get, range(CLIENTS)))
+
+
+def asgi(url):
+    async def run():
+        client = AsyncClient()
+        responses = await asyncio.gather(*[client.get(url) for _ in range(CLIENTS)])
+        return [response.status_code for response in responses]
+
+    return asyncio.run(run())
+
+
+def measure(func, *args):
+    started = time.perf_counter()
+    statuses = func(*args)
+    elapsed = time.perf_counter() - started
+    assert set(statuses) == {200}
+    return CLIENTS / elapsed
+
+
+def test__asgi_concurrency(settings, capsys):
+    settings.ROOT_URLCONF = __name__
+    author = Author.objects.create(name="Автор")
+    Book.objects.bulk_create([Book(author=author, title=f"Книга {i}") for i in range(20)])
+
+    offloaded = f"ASGI, offloaded async views ({settings.BOOKS_ASYNC_MAX_WORKERS} workers)"
+    results = {
+        f"WSGI, {WSGI_THREADS} threads": measure(wsgi),
+        "ASGI, sync DRF views": measure(asgi, "/sync/"),
+        offloaded: measure(asgi, "/async/"),
+    }
+
+    with capsys.disabled():
+        print(f"\n{CLIENTS} concurrent requests, {DELAY * 1000:.0f} ms of blocking work each")
+        for name, rps in results.items():
+            print(f"{name}: {rps:.0f} req/s")
+
+    assert results[offloaded] > results["ASGI, sync DRF views"] * 2
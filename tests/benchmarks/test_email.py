@@ -0,0 +1,37 @@
+import time
+
+import pytest
+from django.core import mail
+
+from core.tasks import deliver_confirmations
+from tests.benchmarks.smtp import SMTPServer
+
+pytestmark = pytest.mark.benchmark
+
+EMAILS = 300
+
+
+def test__email_throughput(settings, capsys):
+    emails = [f"user{i}@gmail.com" for i in range(EMAILS)]
+
+    with SMTPServer() as server:
+        settings.EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+        settings.EMAIL_HOST, settings.EMAIL_PORT = server.server_address
+
+        started = time.perf_counter()
+        for email in emails:
+            mail.send_mail("Письмо с подтверждением регистрации", "123456", settings.DEFAULT_FROM_EMAIL, [email])
+        per_message = EMAILS / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        failed = deliver_confirmations(emails)
+        batched = EMAILS / (time.perf_counter() - started)
+
+        assert not failed
+        assert server.received == EMAILS * 2
+
+    with capsys.disabled():
+        print(f"\nsend_mail per message: {per_message:.0f} emails/s")
+        print(f"deliver_confirmations: {batched:.0f} emails/s ({batched / per_message:.1f}x)")
+
+    assert batched > per_message
@@ -0,0 +1,86 @@
+import pytest
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db.models import Max, Min
+from django.urls import reverse
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from books.models import Book
+from core.codes import get_code_store
+from core.models import User
+from core.tasks import flush_confirmation_emails, send_email_with_confirm
+from tests.benchmarks.conftest import SIZES, USERS, seed_books
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+PASSWORD = "kLmN0PzzZ"
+
+
+def request(method, url, params=None, expected=status.HTTP_200_OK, **extra):
+    def call(i):
+        response = method(url, params(i) if callable(params) else params, **extra)
+        assert response.status_code == expected, response.content
+    return call
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test__book_endpoints(bench, client, size):
+    seed_books(size)
+    first, last = Book.objects.aggregate(Min("id"), Max("id")).values()
+    url = reverse("book-list")
+    uncached = caches["default"].clear
+
+    bench(f"book-list page[{size}]", request(client.get, url, {"page_size": 50}), setup=uncached)
+    bench(f"book-list page cached[{size}]", request(client.get, url, {"page_size": 50}))
+    bench(f"book-list author[{size}]", request(
+        client.get, url, lambda i: {"author": f"Автор {i % 5000}", "ordering": "title", "page_size": 50}
+    ), setup=uncached)
+    bench(f"book-list title prefix[{size}]", request(
+        client.get, url, lambda i: {"title__startswith": f"Книга номер {i}", "page_size": 50}
+    ), setup=uncached)
+    bench(f"book-list search[{size}]", request(client.get, url, lambda i: {"q": str(first + i)}), setup=uncached)
+    bench(f"book-detail[{size}]", lambda i: request(
+        client.get, reverse("book-detail", args=[first + i * (last - first) // 100])
+    )(i), setup=uncached)
+    # Unpaged responses grow with the table, only sensible for small ones
+    if size <= 10000:
+        bench(f"book-list full[{size}]", request(client.get, url), rounds=10, setup=uncached)
+
+
+def test__user_endpoints(bench, client, settings):
+    settings.RATE_LIMITS = {}
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    hashed = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [User(email=f"user{i}@gmail.com", full_name="Афанасьев Николай", password=hashed) for i in range(USERS)],
+        batch_size=5000,
+    )
+
+    bench("registration", request(client.post, reverse("registration"), lambda i: {
+        "full_name": "Афанасьев Николай",
+        "email": f"new{i}@gmail.com",
+        "password": PASSWORD,
+        "password_confirm": PASSWORD,
+    }, expected=status.HTTP_201_CREATED, content_type="application/json"), rounds=20)
+
+    bench("token-obtain-pair", request(client.post, reverse("token-obtain-pair"), lambda i: {
+        "email": f"user{i}@gmail.com",
+        "password": PASSWORD,
+    }, content_type="application/json"), rounds=20)
+
+    token = AccessToken.for_user(User.objects.get(email="user0@gmail.com"))
+    bench("profile", request(client.get, reverse("profile"), HTTP_AUTHORIZATION=f"Bearer {token}"))
+
+
+def test__confirmation_email_tasks(bench, settings):
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    batch = settings.CONFIRM_EMAIL_BATCH_SIZE
+
+    bench("send_email_with_confirm", lambda i: send_email_with_confirm(f"user{i}@gmail.com"), rounds=batch * 5)
+
+    def fill():
+        for i in range(batch):
+            get_code_store().push_pending(f"user{i}@gmail.com")
+
+    bench(f"flush_confirmation_emails[{batch}]", lambda i: flush_confirmation_emails(), rounds=10, setup=fill)
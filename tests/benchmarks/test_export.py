@@ -0,0 +1,41 @@
+import time
+import tracemalloc
+
+import pytest
+
+from books.export import export_books
+from tests.benchmarks.conftest import seed_books
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+SIZES = [10000, 100000]
+
+
+def consume(fmt):
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_byte = None
+    total = 0
+    for chunk in export_books(fmt, compress=True):
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        total += len(chunk)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first_byte * 1000, elapsed * 1000, peak / 1024, total
+
+
+def test__export_memory__constant(capsys):
+    peaks = []
+    with capsys.disabled():
+        print("\nrows      format  first byte, ms  total, ms  peak, KiB  gzip bytes")
+    for size in SIZES:
+        seed_books(size)
+        for fmt in ["ndjson", "csv"]:
+            first_byte, elapsed, peak, total = consume(fmt)
+            peaks.append(peak)
+            with capsys.disabled():
+                print(f"{size:<9} {fmt:<7} {first_byte:<15.1f} {elapsed:<10.1f} {peak:<10.0f} {total}")
+
+    assert peaks[-1] < peaks[0] * 2
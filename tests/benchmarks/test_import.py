@@ -0,0 +1,38 @@
+import io
+import json
+import time
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+
+from books.models import Book
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+PER_REQUEST_ROWS = 500
+IMPORT_ROWS = 100000
+
+
+def test__import_throughput(client, tmp_path, capsys):
+    started = time.perf_counter()
+    for i in range(PER_REQUEST_ROWS):
+        client.post(reverse("book-list"), {"author": "Автор", "title": f"Книга {i}"}, format="json")
+    per_request = PER_REQUEST_ROWS / (time.perf_counter() - started)
+
+    Book.objects.all().delete()
+    path = tmp_path / "books.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(IMPORT_ROWS):
+            f.write(json.dumps({"author": f"Автор {i % 5000}", "title": f"Книга {i}"}, ensure_ascii=False) + "\n")
+
+    started = time.perf_counter()
+    call_command("import_books", str(path), stdout=io.StringIO())
+    command = IMPORT_ROWS / (time.perf_counter() - started)
+
+    with capsys.disabled():
+        print(f"\nPOST /books/: {per_request:.0f} rows/s")
+        print(f"import_books: {command:.0f} rows/s ({command / per_request:.1f}x)")
+
+    assert Book.objects.count() == IMPORT_ROWS
+    assert command > per_request * 5
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from core.middleware import MetricsMiddleware
+
+pytestmark = pytest.mark.benchmark
+
+REQUESTS = 100000
+
+
+def per_request(handler, request):
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        handler(request)
+    return (time.perf_counter() - started) / REQUESTS * 1e6
+
+
+def test__metrics_overhead(capsys):
+    request = RequestFactory().get("/books/")
+    request.resolver_match = resolve("/books/")
+    response = HttpResponse()
+
+    def view(request):
+        return response
+
+    bare = per_request(view, request)
+    recorded = per_request(MetricsMiddleware(view), request)
+
+    with capsys.disabled():
+        print(f"\nMetricsMiddleware: {recorded - bare:.2f} us per request")
+
+    # Includes the cost of the middleware call itself
+    assert recorded - bare < 3
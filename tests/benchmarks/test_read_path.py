@@ -0,0 +1,56 @@
+import time
+import tracemalloc
+
+import pytest
+from django.core.cache import caches
+from rest_framework import generics
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from books.models import Author, Book
+from books.serializers import BookSerializer
+from books.views import BookList
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+ROWS = 500
+REQUESTS = 50
+
+
+# BookList as it was before the values() fast path and FastJSONRenderer
+class SerializerBookList(generics.ListAPIView):
+    serializer_class = BookSerializer
+    permission_classes = [AllowAny]
+    renderer_classes = [JSONRenderer]
+    queryset = Book.objects.select_related("author").order_by("id")
+
+
+def run(view):
+    factory = APIRequestFactory()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        caches["default"].clear()
+        response = view(factory.get("/books/"))
+        response.render()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return REQUESTS / elapsed, peak / 1024, response.content
+
+
+def test__read_path_throughput(capsys):
+    authors = Author.objects.resolve(f"Автор {i}" for i in range(ROWS))
+    Book.objects.bulk_create([Book(author=authors[f"Автор {i}"], title=f"Книга номер {i}") for i in range(ROWS)])
+
+    serializer_rps, serializer_peak, serializer_content = run(SerializerBookList.as_view())
+    fast_rps, fast_peak, fast_content = run(BookList.as_view())
+
+    with capsys.disabled():
+        print(f"\n{ROWS} rows per response")
+        print(f"serializer + JSONRenderer: {serializer_rps:.0f} req/s, peak {serializer_peak:.0f} KiB")
+        print(f"values() + FastJSONRenderer: {fast_rps:.0f} req/s, peak {fast_peak:.0f} KiB")
+
+    assert fast_content == serializer_content
+    assert fast_rps > serializer_rps
@@ -0,0 +1,42 @@
+import statistics
+import time
+
+import pytest
+from django.db.models import Q
+
+from books.models import Author, Book
+from books.search import search_books
+from tests.benchmarks.conftest import seed_books
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+SIZES = [1000, 10000, 100000]
+REPEAT = 20
+
+
+def measure(func):
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def test__search_latency__flat(capsys):
+    Book.objects.create(author=Author.objects.create(name="Лем"), title="Солярис")
+    fts, scan = [], []
+
+    for size in SIZES:
+        seed_books(size)
+        fts.append(measure(lambda: list(search_books(Book.objects.all(), "солярис")[:20])))
+        scan.append(measure(lambda: list(
+            Book.objects.filter(Q(author__name__icontains="солярис") | Q(title__icontains="солярис"))[:20]
+        )))
+
+    with capsys.disabled():
+        print("\nrows      fts, ms   icontains, ms")
+        for size, fts_ms, scan_ms in zip(SIZES, fts, scan):
+            print(f"{size:<9} {fts_ms:<9.3f} {scan_ms:.3f}")
+
+    assert fts[-1] < fts[0] * 3
@@ -0,0 +1,52 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+from django.conf import settings
+
+pytestmark = pytest.mark.benchmark
+
+RUNS = 5
+
+# What a Celery worker loads before taking its first task
+WORKER = """
+import celery_app, django
+django.setup()
+import core.tasks, sys
+print(open("/proc/self/status").read())
+print("DRF:", any(name.split(".")[0] == "rest_framework" for name in sys.modules))
+"""
+
+
+def start_worker(fast_boot):
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "skillfactory.settings", "DJANGO_FAST_BOOT": str(int(fast_boot))}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    # ru_maxrss would include the memory of the forking parent, VmRSS is the worker's own
+    rss = next(line for line in result.stdout.splitlines() if line.startswith("VmRSS:"))
+    if fast_boot:
+        assert "DRF: False" in result.stdout
+    return time.perf_counter() - started, int(rss.split()[1])
+
+
+def measure(fast_boot):
+    runs = [start_worker(fast_boot) for _ in range(RUNS)]
+    return statistics.median(seconds for seconds, _ in runs) * 1000, min(rss for _, rss in runs)
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="needs Linux procfs")
+def test__worker_startup(capsys):
+    full_ms, full_rss = measure(fast_boot=False)
+    fast_ms, fast_rss = measure(fast_boot=True)
+
+    with capsys.disabled():
+        print(f"\nWorker startup: {full_ms:.0f} ms, {full_rss / 1024:.1f} MiB RSS; "
+              f"DJANGO_FAST_BOOT=1: {fast_ms:.0f} ms, {fast_rss / 1024:.1f} MiB RSS")
+
+    # Timings are printed only, a single machine is too noisy to compare two sub-second starts
+    assert fast_rss < full_rss
@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.test import Client
+from django.urls import reverse
+
+from core.models import User
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db(transaction=True)]
+
+ATTACKERS = 20
+REQUESTS = 10
+LIMIT = 5
+
+
+def flood(url, body):
+    def attack(address):
+        client = Client(REMOTE_ADDR=address)
+        return [client.post(url, body, content_type="application/json").status_code for _ in range(REQUESTS)]
+
+    started = time.process_time()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        codes = [code for codes in executor.map(attack, [f"10.0.0.{i}" for i in range(ATTACKERS)]) for code in codes]
+    return time.process_time() - started, codes
+
+
+# Credential stuffing from many addresses against one account: the per-email bucket caps the hashing work
+def test__token_flood_cpu(settings, user_data, capsys):
+    User.objects.create_user(**user_data)
+    url = reverse("token-obtain-pair")
+    body = {"email": user_data["email"], "password": "wrong"}
+
+    settings.RATE_LIMITS = {}
+    unlimited_cpu, unlimited_codes = flood(url, body)
+
+    settings.RATE_LIMITS = {"token": f"{LIMIT}/m"}
+    limited_cpu, limited_codes = flood(url, body)
+
+    with capsys.disabled():
+        print(f"\n{ATTACKERS * REQUESTS} login attempts from {ATTACKERS} addresses")
+        print(f"no limit: {unlimited_cpu:.2f} s CPU")
+        print(f"{LIMIT}/m per address and email: {limited_cpu:.2f} s CPU, {limited_codes.count(429)} rejected")
+
+    assert set(unlimited_codes) == {401}
+    assert limited_codes.count(401) == LIMIT
+    assert limited_cpu < unlimited_cpu / 5
@@ -1,44 +1,71 @@
-import pytest
-from rest_framework.test import APIClient
-
-from core.models import User
-
-
-@pytest.fixture
-def book():
-    return {
-        "author": "Булгаков",
-        "title": "Мастер и Маргарита",
-    }
-
-
-@pytest.fixture
-def user_data():
-    return {
-        "full_name": "Афанасьев Николай",
-        "email": "nick@gmail.com",
-        "password": "kLmN0PzzZ",
-    }
-
-
-@pytest.fixture
-def api_client(user_data):
-    client = APIClient()
-    password = user_data.get("password")
-    user = User.objects.create(id=1, **user_data)
-    user.set_password(password)
-    user.save()
-    client.force_authenticate(user)
-    return client
-
-
-@pytest.fixture
-def another_api_client(user_data):
-    client = APIClient()
-    user_data["email"] = "nick@yandex.ru"
-    password = user_data.get("password")
-    user = User.objects.create(id=2, **user_data)
-    user.set_password(password)
-    user.save()
-    client.force_authenticate(user)
-    return client
+import pytest
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+from core.models import User
+from core.user_cache import local_cache
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    cache.clear()
+    local_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def in_memory_code_store(settings):
+    settings.CONFIRM_CODE_STORE = "core.codes.InMemoryCodeStore"
+
+
+@pytest.fixture(autouse=True)
+def local_rate_limiter(settings):
+    settings.RATE_LIMITER = "core.throttling.LocalRateLimiter"
+
+
+@pytest.fixture
+def book():
+    return {
+        "author": "Булгаков",
+        "title": "Мастер и Маргарита",
+    }
+
+
+@pytest.fixture
+def user_data():
+    return {
+        "full_name": "Афанасьев Николай",
+        "email": "nick@gmail.com",
+        "password": "kLmN0PzzZ",
+    }
+
+
+@pytest.fixture
+def api_client(user_data):
+    client = APIClient()
+    password = user_data.get("password")
+    user = User.objects.create(id=1, **user_data)
+    user.set_password(password)
+    user.save()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def another_api_client(user_data):
+    client = APIClient()
+    user_data["email"] = "nick@yandex.ru"
+    password = user_data.get("password")
+    user = User.objects.create(id=2, **user_data)
+    user.set_password(password)
+    user.save()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def admin_api_client(user_data):
+    client = APIClient()
+    user = User.objects.create_superuser(email="admin@gmail.com", password=user_data["password"], full_name="Админ")
+    client.force_authenticate(user)
+    return client
@@ -1,56 +1,976 @@
-import pytest
-from django.urls import reverse
-from rest_framework import status
-
-# to use db
-pytestmark = pytest.mark.django_db(transaction=True)
-
-
-def test__book_add__success(client, book):
-    response = client.post(reverse("book-list"), book, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-    assert response.json()["title"] == book["title"]
-    assert response.json()["author"] == book["author"]
-
-
-def test__book_add__fail(client):
-    response = client.post(reverse("book-list"), {}, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json() == {"author": ["Это поле обязательно."], "title": ["Это поле обязательно."]}
-
-
-def test__book_list__success(client, book):
-    client.post(reverse("book-list"), book, format="json")
-
-    response = client.get(reverse("book-list"))
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()[0]["title"] == book["title"]
-    assert response.json()[0]["author"] == book["author"]
-
-
-def test__book_get_detail__success(client, book):
-    response = client.post(reverse("book-list"), book, format="json")
-    book_id = response.json()["id"]
-    response = client.get(reverse("book-detail", kwargs={"pk": book_id}))
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()["title"] == book["title"]
-    assert response.json()["author"] == book["author"]
-
-
-def test__book_get_detail__not_found__fail(client):
-    book_id = 123
-    response = client.get(reverse("book-detail", kwargs={"pk": book_id}))
-    assert response.status_code == status.HTTP_404_NOT_FOUND
-
-
-def test__book_delete__success(client, book):
-    response = client.post(reverse("book-list"), book, format="json")
-    book_id = response.json()["id"]
-    response = client.delete(reverse("book-detail", kwargs={"pk": book_id}))
-    assert response.status_code == status.HTTP_204_NO_CONTENT
-
-
-def test__book_delete__fail(client, book):
-    book_id = 123
-    response = client.delete(reverse("book-detail", kwargs={"pk": book_id}))
-    assert response.status_code == status.HTTP_404_NOT_FOUND
+import asyncio
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, router
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from books.cache import get_timeout
+from books.models import Author, Book, BookChange
+from books.pagination import BookCursorPagination
+from books.search import drop_triggers, install_triggers
+from books.serializers import BookSerializer
+from books.views import BookChanges, BookList, BookDetail
+from books.views_async import long_poll, offload
+from core.asgi import ASGIHandler
+from core.middleware import MetricsMiddleware, ReplicaMiddleware
+from core.routers import is_healthy
+
+# to use db
+pytestmark = pytest.mark.django_db(transaction=True, databases="__all__")
+
+
+def create_book(author, title):
+    return Book.objects.create(author=Author.objects.resolve([author])[author], title=title)
+
+
+def test__book_add__success(client, book):
+    response = client.post(reverse("book-list"), book, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["title"] == book["title"]
+    assert response.json()["author"] == book["author"]
+
+
+def test__book_add__fail(client):
+    response = client.post(reverse("book-list"), {}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"author": ["Это поле обязательно."], "title": ["Это поле обязательно."]}
+
+
+def test__book_list__success(client, book):
+    client.post(reverse("book-list"), book, format="json")
+
+    response = client.get(reverse("book-list"))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]["title"] == book["title"]
+    assert response.json()[0]["author"] == book["author"]
+
+
+def test__book_get_detail__success(client, book):
+    response = client.post(reverse("book-list"), book, format="json")
+    book_id = response.json()["id"]
+    response = client.get(reverse("book-detail", kwargs={"pk": book_id}))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["title"] == book["title"]
+    assert response.json()["author"] == book["author"]
+
+
+def test__book_get_detail__not_found__fail(client):
+    book_id = 123
+    response = client.get(reverse("book-detail", kwargs={"pk": book_id}))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test__book_delete__success(client, book):
+    response = client.post(reverse("book-list"), book, format="json")
+    book_id = response.json()["id"]
+    response = client.delete(reverse("book-detail", kwargs={"pk": book_id}))
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+def test__book_delete__fail(client, book):
+    book_id = 123
+    response = client.delete(reverse("book-detail", kwargs={"pk": book_id}))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test__book_list__cursor_pagination__success(client, book):
+    for i in range(5):
+        client.post(reverse("book-list"), {**book, "title": f"{book['title']} {i}"}, format="json")
+
+    response = client.get(reverse("book-list"), {"page_size": 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["previous"] is None
+
+    ids = []
+    pages = 0
+    url = reverse("book-list") + "?page_size=2"
+    while url:
+        response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()["results"]) <= 2
+        ids += [item["id"] for item in response.json()["results"]]
+        url = response.json()["next"]
+        pages += 1
+
+    assert pages == 3
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 5
+
+    response = client.get(reverse("book-list"), {"page_size": 2, "ordering": "-id"})
+    assert [item["id"] for item in response.json()["results"]] == ids[::-1][:2]
+
+    previous = client.get(response.json()["next"]).json()["previous"]
+    assert [item["id"] for item in client.get(previous).json()["results"]] == ids[::-1][:2]
+
+
+@patch.object(BookCursorPagination, "max_page_size", 3)
+def test__book_list__cursor_pagination__page_size_bounded(client, book):
+    books = [{**book, "title": f"{book['title']} {i}"} for i in range(5)]
+    client.post(reverse("book-bulk"), books, content_type="application/json")
+
+    response = client.get(reverse("book-list"), {"page_size": 100000})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()["results"]) == 3
+    assert response.json()["next"] is not None
+
+
+def test__book_list__cursor_pagination__invalid_cursor__fail(client):
+    response = client.get(reverse("book-list"), {"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test__book_bulk_create__success(client, book):
+    books = [{**book, "title": f"{book['title']} {i}"} for i in range(3)]
+
+    response = client.post(reverse("book-bulk"), books, content_type="application/json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [item["title"] for item in response.json()] == [item["title"] for item in books]
+
+    response = client.get(reverse("book-list"))
+    assert [item["title"] for item in response.json()] == [item["title"] for item in books]
+
+
+def test__book_bulk_create__returns_ids(client, book):
+    create_book(**book)
+    books = [{**book, "title": f"{book['title']} {i}"} for i in range(3)]
+
+    response = client.post(reverse("book-bulk"), books, content_type="application/json")
+    created = [(item["id"], item["author"], item["title"]) for item in response.json()]
+    assert all(pk is not None for pk, _, _ in created)
+    assert created == list(Book.objects.filter(id__in=[pk for pk, _, _ in created]).order_by("id").values_list(
+        "id", "author__name", "title"
+    ))
+
+
+def test__book_bulk_create__fail(client, book):
+    response = client.post(reverse("book-bulk"), [book, {"author": book["author"]}], content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()[0] == {}
+    assert list(response.json()[1]) == ["title"]
+
+    response = client.post(reverse("book-bulk"), book, content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = client.get(reverse("book-list"))
+    assert response.json() == []
+
+
+def test__book_bulk_update__success(client, book):
+    client.post(reverse("book-bulk"), [book, book], content_type="application/json")
+    ids = [item["id"] for item in client.get(reverse("book-list")).json()]
+
+    response = client.patch(
+        reverse("book-bulk"), [{"id": ids[0], "title": "Белая гвардия"}, {"id": ids[1]}],
+        content_type="application/json",
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = client.get(reverse("book-list"))
+    assert [item["title"] for item in response.json()] == ["Белая гвардия", book["title"]]
+
+
+def test__book_bulk_update__fail(client, book):
+    response = client.post(reverse("book-list"), book, format="json")
+    book_id = response.json()["id"]
+
+    response = client.patch(
+        reverse("book-bulk"), [{"id": book_id, "title": "Белая гвардия"}, {"id": 123}, {}],
+        content_type="application/json",
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == [{}, {"id": ["Книга не найдена."]}, {"id": ["Книга не найдена."]}]
+
+    response = client.patch(reverse("book-bulk"), [{"id": book_id}, {"id": book_id}], content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == [{}, {"id": ["Повторяющийся id."]}]
+
+    # JSON booleans are not ids, even though True == 1
+    response = client.patch(reverse("book-bulk"), [{"id": True, "title": "Белая гвардия"}],
+                            content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == [{"id": ["Книга не найдена."]}]
+
+    response = client.get(reverse("book-detail", kwargs={"pk": book_id}))
+    assert response.json()["title"] == book["title"]
+
+
+def test__book_bulk_delete__success(client, book):
+    client.post(reverse("book-bulk"), [book, book, book], content_type="application/json")
+    ids = [item["id"] for item in client.get(reverse("book-list")).json()]
+
+    response = client.delete(reverse("book-bulk"), {"ids": ids[:2] + [123]}, content_type="application/json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"deleted": 2}
+
+    response = client.get(reverse("book-list"))
+    assert [item["id"] for item in response.json()] == ids[2:]
+
+    response = client.delete(reverse("book-bulk"), {"ids": "1,2"}, content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = client.delete(reverse("book-bulk"), {"ids": [True]}, content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"ids": ["Ожидался список id."]}
+
+
+def test__book_search__success(client, book):
+    books = [
+        book,
+        {"author": "Булгаков", "title": "Собачье сердце"},
+        {"author": "Толстой", "title": "Война и мир"},
+    ]
+    client.post(reverse("book-bulk"), books, content_type="application/json")
+
+    response = client.get(reverse("book-list"), {"q": "булгак"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["count"] == 2
+    assert {item["title"] for item in response.json()["results"]} == {book["title"], "Собачье сердце"}
+
+    response = client.get(reverse("book-list"), {"q": "толстой мир"})
+    assert [item["title"] for item in response.json()["results"]] == ["Война и мир"]
+
+    response = client.get(reverse("book-list"), {"q": "булгаков", "page_size": 1})
+    assert len(response.json()["results"]) == 1
+    assert response.json()["next"]
+
+    response = client.get(reverse("book-list"), {"q": '"*'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["count"] == 0
+
+
+def test__book_search__index_follows_writes(client, book):
+    response = client.post(reverse("book-list"), book, format="json")
+    book_id = response.json()["id"]
+
+    client.patch(reverse("book-detail", kwargs={"pk": book_id}), {"title": "Белая гвардия"},
+                 content_type="application/json")
+    assert client.get(reverse("book-list"), {"q": "маргарита"}).json()["count"] == 0
+    assert client.get(reverse("book-list"), {"q": "гвардия"}).json()["count"] == 1
+
+    client.delete(reverse("book-detail", kwargs={"pk": book_id}))
+    assert client.get(reverse("book-list"), {"q": "гвардия"}).json()["count"] == 0
+
+
+def test__book_cache__hit_and_invalidation(client, book, django_assert_num_queries):
+    response = client.post(reverse("book-list"), book, format="json")
+    book_id = response.json()["id"]
+
+    client.get(reverse("book-list"))
+    client.get(reverse("book-detail", kwargs={"pk": book_id}))
+    with django_assert_num_queries(0):
+        assert client.get(reverse("book-list")).json()[0]["title"] == book["title"]
+        assert client.get(reverse("book-detail", kwargs={"pk": book_id})).json()["title"] == book["title"]
+
+    client.patch(reverse("book-detail", kwargs={"pk": book_id}), {"title": "Белая гвардия"},
+                 content_type="application/json")
+    assert client.get(reverse("book-list")).json()[0]["title"] == "Белая гвардия"
+    assert client.get(reverse("book-detail", kwargs={"pk": book_id})).json()["title"] == "Белая гвардия"
+
+    client.post(reverse("book-bulk"), [book], content_type="application/json")
+    assert len(client.get(reverse("book-list")).json()) == 2
+
+    client.delete(reverse("book-bulk"), {"ids": [book_id]}, content_type="application/json")
+    assert len(client.get(reverse("book-list")).json()) == 1
+
+
+def test__book_cache__single_flight(client, book, settings):
+    settings.BOOKS_CACHE_LOCK_WAIT = 0.05
+    client.post(reverse("book-list"), book, format="json")
+
+    # A rebuild already in flight elsewhere: we wait, then rebuild ourselves without touching its lock
+    client.get(reverse("book-list"))
+    caches["default"].clear()
+    with patch.object(caches["default"], "add", return_value=False):
+        response = client.get(reverse("book-list"))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]["title"] == book["title"]
+
+
+def test__book_cache__pinned_bypass(client, book, settings):
+    pk = create_book(**book).id
+    detail, batch = reverse("book-detail", args=[pk]), reverse("book-list")
+    client.get(detail)
+    client.get(batch, {"ids": str(pk)})
+
+    # As if the entries had been filled from a replica that had not caught up with the last write
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE books_book SET title = %s WHERE id = %s", ["Белая гвардия", pk])
+    assert client.get(detail).json()["title"] == book["title"]
+
+    # A client pinned to the primary after its own write reads it
+    client.cookies["db_pin"] = "1"
+    assert client.get(detail).json()["title"] == "Белая гвардия"
+    assert client.get(batch, {"ids": str(pk)}).json()["results"][0]["title"] == "Белая гвардия"
+
+    assert get_timeout() == settings.BOOKS_CACHE_TIMEOUT
+    with patch("core.routers.read_from_replica", return_value=True):
+        assert get_timeout() == settings.DATABASE_REPLICA_PIN_SECONDS
+
+
+def test__book_cache_stats__success(client, book, admin_api_client):
+    client.get(reverse("book-list"))
+    client.get(reverse("book-list"))
+
+    response = admin_api_client.get(reverse("book-cache-stats"))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["hits"] >= 1
+    assert response.json()["misses"] >= 1
+
+    response = client.get(reverse("book-cache-stats"))
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test__book_export__ndjson__success(client, book, settings):
+    settings.BOOKS_EXPORT_CHUNK_SIZE = 2
+    books = [{**book, "title": f"{book['title']} {i}"} for i in range(5)]
+    client.post(reverse("book-bulk"), books, content_type="application/json")
+
+    response = client.get(reverse("book-export"))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response["Content-Type"] == "application/x-ndjson; charset=utf-8"
+
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).decode("utf-8").splitlines()]
+    assert [row["title"] for row in rows] == [item["title"] for item in books]
+    assert list(rows[0]) == ["id", "author", "title"]
+
+
+def test__book_export__ndjson__error(client):
+    response = client.get(reverse("book-export"), HTTP_ACCEPT="application/xml")
+    assert response.status_code == status.HTTP_406_NOT_ACCEPTABLE
+    assert response["Content-Type"] == "application/x-ndjson; charset=utf-8"
+    [line] = response.content.decode("utf-8").splitlines()
+    assert list(json.loads(line)) == ["detail"]
+
+
+def test__book_export__asgi(book, settings):
+    settings.BOOKS_EXPORT_CHUNK_SIZE = 2
+    for i in range(5):
+        create_book(book["author"], f"{book['title']} {i}")
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    # Django's own handler iterates the generator on the event loop and fails on its first query
+    scope = {"type": "http", "method": "GET", "path": reverse("book-export"), "query_string": b"", "headers": []}
+    async_to_sync(ASGIHandler())(scope, receive, send)
+
+    start, *body = messages
+    assert start["status"] == status.HTTP_200_OK
+    assert (b"Content-Type", b"application/x-ndjson; charset=utf-8") in start["headers"]
+    assert len(body) > 2
+    assert body[-1] == {"type": "http.response.body"}
+    rows = [json.loads(line) for line in b"".join(message.get("body", b"") for message in body).splitlines()]
+    assert [row["title"] for row in rows] == [f"{book['title']} {i}" for i in range(5)]
+
+
+def test__book_export__csv_gzip__success(client, book):
+    client.post(reverse("book-list"), book, format="json")
+
+    response = client.get(reverse("book-export"), {"format": "csv"}, HTTP_ACCEPT_ENCODING="gzip, deflate")
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Content-Type"] == "text/csv; charset=utf-8"
+
+    content = gzip.decompress(b"".join(response.streaming_content)).decode("utf-8")
+    rows = list(csv.reader(io.StringIO(content)))
+    assert rows[0] == ["id", "author", "title"]
+    assert rows[1][1:] == [book["author"], book["title"]]
+
+
+def test__import_books__success(tmp_path, book):
+    create_book(**book)
+    csv_path = tmp_path / "books.csv"
+    csv_path.write_text(
+        "author,title\n"
+        f"{book['author']},{book['title']}\n"
+        "Толстой,Война и мир\n"
+        "Толстой,Война и мир\n"
+        "Толстой,\n",
+        encoding="utf-8",
+    )
+    jsonl_path = tmp_path / "books.jsonl"
+    jsonl_path.write_text(
+        json.dumps({"author": "Чехов", "title": "Вишневый сад"}, ensure_ascii=False) + "\n{broken\n"
+        # Already imported from the CSV, in an earlier batch
+        f"{json.dumps({'author': 'Толстой', 'title': 'Война и мир'}, ensure_ascii=False)}\n",
+        encoding="utf-8",
+    )
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command("import_books", str(csv_path), str(jsonl_path), batch_size=2, stdout=stdout, stderr=stderr)
+
+    titles = sorted(Book.objects.values_list("title", flat=True))
+    assert titles == sorted([book["title"], "Война и мир", "Вишневый сад"])
+    assert "Imported 2 of 7 rows (3 duplicates, 2 invalid)" in stdout.getvalue()
+    assert "rows/s" in stdout.getvalue()
+
+
+def test__import_books__resume(tmp_path, book):
+    path = tmp_path / "books.jsonl"
+    path.write_text("".join(
+        json.dumps({"author": book["author"], "title": f"{book['title']} {i}"}, ensure_ascii=False) + "\n"
+        for i in range(5)
+    ), encoding="utf-8")
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({str(path): 3}))
+
+    stdout = io.StringIO()
+    call_command("import_books", str(path), checkpoint=str(checkpoint), stdout=stdout)
+
+    assert sorted(Book.objects.values_list("title", flat=True)) == [f"{book['title']} {i}" for i in (3, 4)]
+    assert "resuming after 3 rows" in stdout.getvalue()
+    assert json.loads(checkpoint.read_text()) == {str(path): 5}
+
+
+def test__book_read_path__matches_serializer(client, book):
+    books = [book, {"author": "Пушкин", "title": 'Строка\u2028 "кавычки"'}]
+    client.post(reverse("book-bulk"), books, content_type="application/json")
+    instances = Book.objects.order_by("id")
+
+    expected = JSONRenderer().render(BookSerializer(instances, many=True).data)
+    assert client.get(reverse("book-list")).content == expected
+
+    expected = JSONRenderer().render(BookSerializer(instances[1]).data)
+    assert client.get(reverse("book-detail", kwargs={"pk": instances[1].id})).content == expected
+
+
+def test__book_fast_json_parser__fail(client):
+    response = client.post(reverse("book-list"), "{broken", content_type="application/json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"].startswith("JSON parse error")
+
+
+def test__book_async_views__success(book):
+    factory = AsyncRequestFactory()
+    book_list = offload(BookList.as_view())
+    book_detail = offload(BookDetail.as_view())
+    assert asyncio.iscoroutinefunction(book_list)
+
+    response = async_to_sync(book_list)(factory.post("/books/", book, content_type="application/json"))
+    assert response.status_code == status.HTTP_201_CREATED
+    book_id = json.loads(response.content)["id"]
+
+    response = async_to_sync(book_detail)(factory.get(f"/books/{book_id}"), pk=book_id)
+    assert response.status_code == status.HTTP_200_OK
+    assert json.loads(response.content)["title"] == book["title"]
+
+    response = async_to_sync(book_detail)(factory.delete(f"/books/{book_id}"), pk=book_id)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert json.loads(async_to_sync(book_list)(factory.get("/books/")).content) == []
+
+
+def route(request, write=False):
+    routed = []
+
+    def view(request):
+        request.resolver_match = resolve(request.path)
+        routed.append(router.db_for_read(Book))
+        if write:
+            router.db_for_write(Book)
+            routed.append(router.db_for_read(Book))
+        return HttpResponse()
+
+    response = ReplicaMiddleware(view)(request)
+    return routed, response
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1", "replica_2"])
+@patch("core.routers.is_healthy", return_value=True)
+def test__replica_router__read_your_writes(is_healthy, rf):
+    routed, response = route(rf.get(reverse("book-list")))
+    assert routed[0] in ["replica_1", "replica_2"]
+    assert "db_pin" not in response.cookies
+
+    routed, response = route(rf.get(reverse("profile")), write=True)
+    assert routed[0] in ["replica_1", "replica_2"]
+    assert routed[1] == "default"
+    assert response.cookies["db_pin"]["max-age"] == 5
+
+    request = rf.get(reverse("book-detail", args=[1]))
+    request.COOKIES["db_pin"] = "1"
+    assert route(request)[0] == ["default"]
+
+    assert route(rf.post(reverse("book-list")))[0] == ["default"]
+    assert route(rf.get(reverse("book-bulk")))[0] == ["default"]
+    assert router.db_for_read(Book) == "default"
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1", "replica_2"])
+@patch("core.routers.is_healthy", side_effect=lambda alias: alias == "replica_2")
+def test__replica_router__unhealthy_fallback(is_healthy, rf):
+    assert route(rf.get(reverse("book-list")))[0] == ["replica_2"]
+
+    is_healthy.side_effect = None
+    is_healthy.return_value = False
+    assert route(rf.get(reverse("book-list")))[0] == ["default"]
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1", "replica_2"])
+@patch("core.routers.is_healthy", return_value=True)
+def test__replica_middleware__async(is_healthy, rf):
+    routed = []
+
+    def write(request):
+        routed.append(router.db_for_read(Book))
+        router.db_for_write(Book)
+        routed.append(router.db_for_read(Book))
+        return HttpResponse()
+
+    # Like the book views under ASGI: the sync part runs on the pool in a copy of the request's context
+    offloaded = offload(write)
+
+    async def view(request):
+        request.resolver_match = resolve(request.path)
+        return await offloaded(request)
+
+    middleware = MetricsMiddleware(ReplicaMiddleware(view))
+    assert asyncio.iscoroutinefunction(middleware)
+
+    response = async_to_sync(middleware)(rf.get(reverse("profile")))
+    assert routed[0] in ["replica_1", "replica_2"]
+    assert routed[1] == "default"
+    assert response.cookies["db_pin"]["max-age"] == 5
+
+
+def test__replica_health_check__cached(settings):
+    settings.DATABASE_REPLICA_HEALTH_INTERVAL = 60
+    assert is_healthy("default")
+
+    with patch.object(connections["default"], "cursor", side_effect=DatabaseError):
+        assert is_healthy("default")
+        settings.DATABASE_REPLICA_HEALTH_INTERVAL = 0
+        assert not is_healthy("default")
+    assert is_healthy("default")
+
+
+def test__book_list__filter_and_ordering(client):
+    create_book("Булгаков", "Мастер и Маргарита")
+    create_book("Булгаков", "Белая гвардия")
+    create_book("Пушкин", "Медный всадник")
+    create_book("Пушкин", "мцыри")
+
+    response = client.get(reverse("book-list"), {"author": "Булгаков", "ordering": "title"})
+    assert [item["title"] for item in response.json()] == ["Белая гвардия", "Мастер и Маргарита"]
+
+    response = client.get(reverse("book-list"), {"title__startswith": "М", "ordering": "-author"})
+    assert [item["title"] for item in response.json()] == ["Медный всадник", "Мастер и Маргарита"]
+
+    # No code point above U+10FFFF to bound the range with
+    create_book("Пушкин", "М\U0010ffff\U0010ffff")
+    response = client.get(reverse("book-list"), {"title__startswith": "М\U0010ffff"})
+    assert [item["title"] for item in response.json()] == ["М\U0010ffff\U0010ffff"]
+    response = client.get(reverse("book-list"), {"title__startswith": "\ud7ff"})
+    assert response.json() == []
+
+    # Not indexed, so ignored
+    response = client.get(reverse("book-list"), {"author__contains": "Пуш", "ordering": "-author__len"})
+    assert [item["id"] for item in response.json()] == sorted(Book.objects.values_list("id", flat=True))
+
+
+@pytest.mark.parametrize("params, index", [
+    ({"author": "Булгаков"}, "books_book_author_idx"),
+    ({"title__startswith": "Мастер"}, "books_book_title_idx"),
+    ({"author": "Булгаков", "ordering": "title"}, "books_book_author_title_idx"),
+    ({"ordering": "-title"}, "books_book_title_idx"),
+])
+def test__book_list__query_plan_uses_index(params, index):
+    view = BookList()
+    view.request = view.initialize_request(APIRequestFactory().get(reverse("book-list"), params))
+    view.format_kwarg = None
+
+    plan = view.filter_queryset(view.get_queryset()).explain()
+    assert f"INDEX {index}" in plan
+
+
+def test__book_version__write_paths(book):
+    created = create_book(**book)
+    assert created.version == 1
+
+    created.title = "Белая гвардия"
+    created.save(update_fields=["title"])
+    created.refresh_from_db()
+    assert created.version == 2
+
+    updated_at = created.updated_at
+    Book.objects.filter(id=created.id).update(title="Собачье сердце")
+    created.refresh_from_db()
+    assert created.version == 3
+    assert created.updated_at > updated_at
+
+    bulk = create_book(**book)
+    bulk.title = "Морфий"
+    Book.objects.bulk_update([bulk], ["title"])
+    bulk.refresh_from_db()
+    assert (bulk.title, bulk.version) == ("Морфий", 2)
+    assert bulk.updated_at > created.updated_at
+
+
+def test__book_detail__conditional_get(client, book):
+    pk = client.post(reverse("book-list"), book, format="json").json()["id"]
+    url = reverse("book-detail", args=[pk])
+
+    response = client.get(url)
+    etag, last_modified = response["ETag"], response["Last-Modified"]
+    assert response.status_code == status.HTTP_200_OK
+
+    # The second request is answered from the response cache, with the same validators
+    for _ in range(2):
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response["ETag"] == etag
+        assert not response.content
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == status.HTTP_304_NOT_MODIFIED
+
+    client.patch(url, {"title": "Белая гвардия"}, content_type="application/json")
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] != etag
+    assert response.json()["title"] == "Белая гвардия"
+
+
+def test__book_list__conditional_get(client, book):
+    client.post(reverse("book-list"), book, format="json")
+    url = reverse("book-list")
+
+    etag = client.get(url)["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_304_NOT_MODIFIED
+    # Another query is another representation
+    assert client.get(url, {"page_size": 10}, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+
+    create_book(**book)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()) == 2
+
+    etag = response["ETag"]
+    Book.objects.order_by("id").last().delete()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+
+
+def test__book_detail__if_match(client, book):
+    pk = client.post(reverse("book-list"), book, format="json").json()["id"]
+    url = reverse("book-detail", args=[pk])
+    etag = client.get(url)["ETag"]
+
+    response = client.patch(url, {"title": "Белая гвардия"}, content_type="application/json", HTTP_IF_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] == client.get(url)["ETag"] != etag
+
+    response = client.put(url, book, content_type="application/json", HTTP_IF_MATCH=etag)
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert client.delete(url, HTTP_IF_MATCH=etag).status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert Book.objects.get(id=pk).title == "Белая гвардия"
+
+    assert client.delete(url, HTTP_IF_MATCH=client.get(url)["ETag"]).status_code == status.HTTP_204_NO_CONTENT
+
+
+def test__book_sparse_fields__success(client, book):
+    books = [book, {"author": "Пушкин", "title": "Дубровский"}]
+    client.post(reverse("book-bulk"), books, content_type="application/json")
+    instances = Book.objects.order_by("id")
+
+    expected = JSONRenderer().render(BookSerializer(instances, many=True, fields=["title", "id"]).data)
+    assert client.get(reverse("book-list"), {"fields": "title,id"}).content == expected
+    assert client.get(reverse("book-list"), {"exclude": "author"}).content == expected
+
+    response = client.get(reverse("book-detail", args=[instances[1].id]), {"fields": "title"})
+    assert response.json() == {"title": "Дубровский"}
+
+    # The cursor still needs the ordering column, which is fetched but not returned
+    response = client.get(reverse("book-list"), {"fields": "id", "ordering": "-author", "page_size": 1}).json()
+    assert response["results"] == [{"id": instances[1].id}]
+    assert client.get(response["next"]).json()["results"] == [{"id": instances[0].id}]
+
+
+def test__book_sparse_fields__projection(client, book):
+    create_book(**book)
+    with CaptureQueriesContext(connection) as queries:
+        client.get(reverse("book-list"), {"fields": "id"})
+    [select] = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+    assert '"title"' not in select and '"author"' not in select
+
+
+@pytest.mark.parametrize("params, errors", [
+    ({"fields": "id,isbn"}, {"fields": ["Неизвестные поля: isbn."]}),
+    ({"exclude": "id,author,title"}, {"fields": ["Не выбрано ни одного поля."]}),
+])
+def test__book_sparse_fields__fail(client, params, errors):
+    response = client.get(reverse("book-list"), params)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == errors
+
+
+def assert_book_counts():
+    counts = dict(Book.objects.values_list("author__name").annotate(books=Count("id")))
+    assert {author.name: author.book_count for author in Author.objects.filter(book_count__gt=0)} == counts
+
+
+def test__author_book_count__write_paths(client, book):
+    pk = client.post(reverse("book-list"), book, format="json").json()["id"]
+    books = [book, {"author": "Пушкин", "title": "Дубровский"}]
+    client.post(reverse("book-bulk"), books, content_type="application/json")
+    assert_book_counts()
+    assert Author.objects.get(name=book["author"]).book_count == 2
+
+    client.patch(reverse("book-detail", args=[pk]), {"author": "Гоголь"}, content_type="application/json")
+    assert_book_counts()
+
+    ids = list(Book.objects.filter(author__name=book["author"]).values_list("id", flat=True))
+    client.patch(reverse("book-bulk"), [{"id": pk, "author": "Пушкин"}, {"id": ids[0], "author": "Гоголь"}],
+                 content_type="application/json")
+    assert_book_counts()
+
+    gogol = Author.objects.get(name="Гоголь")
+    Book.objects.filter(author__name="Пушкин").update(author=gogol)
+    assert_book_counts()
+    assert Author.objects.get(name="Гоголь").book_count == 3
+
+    pushkin = Author.objects.get(name="Пушкин")
+    Book.objects.filter(id=pk).update(author_id=pushkin.id)
+    assert_book_counts()
+    assert Author.objects.get(name="Пушкин").book_count == 1
+
+    client.delete(reverse("book-detail", args=[pk]))
+    assert_book_counts()
+    Book.objects.all().delete()
+    assert set(Author.objects.values_list("book_count", flat=True)) == {0}
+
+
+def test__author_list__success(client, book, django_assert_num_queries):
+    client.post(reverse("book-bulk"), [
+        book, {"author": book["author"], "title": "Белая гвардия"}, {"author": "Пушкин", "title": "Дубровский"},
+    ], content_type="application/json")
+    Author.objects.create(name="Без книг")
+
+    with django_assert_num_queries(1) as queries:
+        response = client.get(reverse("author-list"), {"ordering": "-book_count"})
+    # Counts are read, not aggregated
+    assert "COUNT(" not in queries.captured_queries[0]["sql"].upper()
+    assert [(item["name"], item["book_count"]) for item in response.json()] == [(book["author"], 2), ("Пушкин", 1)]
+
+    response = client.get(reverse("author-list"), {"page_size": 1}).json()
+    assert [item["name"] for item in response["results"]] == [book["author"]]
+    assert [item["name"] for item in client.get(response["next"]).json()["results"]] == ["Пушкин"]
+
+
+def test__book_search__follows_author_rename(client, book):
+    create_book(**book)
+    Author.objects.filter(name=book["author"]).update(name="Михаил Булгаков")
+    assert len(client.get(reverse("book-list"), {"q": "михаил"}).json()["results"]) == 1
+
+
+def test__author_rename__changes_books(client, book):
+    pk = client.post(reverse("book-list"), book, format="json").json()["id"]
+    other = create_book(author="Пушкин", title="Дубровский")
+    url = reverse("book-detail", args=[pk])
+    etag = client.get(url)["ETag"]
+    assert client.get(reverse("book-list")).json()[0]["author"] == book["author"]
+    since = BookChange.objects.latest("id").id
+
+    author = Author.objects.get(name=book["author"])
+    author.book_count = 5
+    author.save()
+    assert BookChange.objects.filter(id__gt=since).count() == 0
+
+    author.name = "Михаил Булгаков"
+    author.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["author"] == "Михаил Булгаков"
+    assert client.get(reverse("book-list")).json()[0]["author"] == "Михаил Булгаков"
+
+    Author.objects.filter(name="Пушкин").update(name="Александр Пушкин")
+    assert client.get(reverse("book-detail", args=[other.pk])).json()["author"] == "Александр Пушкин"
+    assert list(BookChange.objects.filter(id__gt=since).values_list("book_id", "action")) == [
+        (pk, "updated"), (other.pk, "updated"),
+    ]
+
+
+def test__author_migration__dedupes_names():
+    # The migrate command does this around migrations, the executor alone doesn't
+    drop_triggers()
+    executor = MigrationExecutor(connection)
+    executor.migrate([("books", "0004_book_version")])
+    apps = executor.loader.project_state([("books", "0004_book_version")]).apps
+    OldBook = apps.get_model("books", "Book")
+    OldBook.objects.bulk_create([
+        OldBook(author="Булгаков", title="Мастер и Маргарита"),
+        OldBook(author="Булгаков", title="Белая гвардия"),
+        OldBook(author="Пушкин", title="Дубровский"),
+    ])
+
+    executor = MigrationExecutor(connection)
+    executor.migrate(executor.loader.graph.leaf_nodes())
+    install_triggers()
+    assert dict(Author.objects.values_list("name", "book_count")) == {"Булгаков": 2, "Пушкин": 1}
+    assert Book.objects.get(title="Дубровский").author.name == "Пушкин"
+
+
+def test__book_changes__write_paths(client, book):
+    pk = client.post(reverse("book-list"), book, format="json").json()["id"]
+    books = [{"author": "Пушкин", "title": "Дубровский"}, {"author": "Гоголь", "title": "Нос"}]
+    created = [item["id"] for item in client.post(reverse("book-bulk"), books, content_type="application/json").json()]
+    assert created == [pk + 1, pk + 2]
+
+    client.patch(reverse("book-detail", args=[pk]), {"title": "Белая гвардия"}, content_type="application/json")
+    client.patch(reverse("book-bulk"), [{"id": created[0], "title": "Метель"}], content_type="application/json")
+    Book.objects.filter(id=created[1]).update(title="Шинель")
+    client.delete(reverse("book-detail", args=[pk]))
+    Book.objects.filter(id__in=created).delete()
+
+    assert list(BookChange.objects.order_by("id").values_list("book_id", "action")) == [
+        (pk, "created"), (created[0], "created"), (created[1], "created"),
+        (pk, "updated"), (created[0], "updated"), (created[1], "updated"),
+        (pk, "deleted"), (created[0], "deleted"), (created[1], "deleted"),
+    ]
+
+
+def test__book_changes__feed(client, book):
+    first, second, third = (create_book(**book) for _ in range(3))
+    first.title = "Белая гвардия"
+    first.save()
+    deleted = second.id
+    second.delete()
+
+    changes, params = [], {"page_size": 2}
+    while True:
+        response = client.get(reverse("book-changes"), params).json()
+        changes += response["changes"]
+        params["since"] = response["cursor"]
+        if not response["more"]:
+            break
+        assert response["next"].endswith(f"since={response['cursor']}")
+
+    updated = {"id": first.id, "author": book["author"], "title": "Белая гвардия"}
+    assert [(item["id"], item["action"], item["book"]) for item in changes] == [
+        # Books are reported as they are now, deleted ones as tombstones
+        (first.id, "created", updated),
+        (deleted, "deleted", None),
+        (third.id, "created", {"id": third.id, "author": book["author"], "title": book["title"]}),
+        (first.id, "updated", updated),
+        (deleted, "deleted", None),
+    ]
+    assert client.get(reverse("book-changes"), {"since": params["since"]}).json()["changes"] == []
+
+    # Within a page, each book is reported once at its last change
+    response = client.get(reverse("book-changes")).json()
+    assert [(item["id"], item["action"]) for item in response["changes"]] == [
+        (third.id, "created"), (first.id, "updated"), (deleted, "deleted"),
+    ]
+    start = changes[0]["change"]
+    assert [item["change"] for item in response["changes"]] == [start + 2, start + 3, start + 4]
+
+
+@pytest.mark.parametrize("params", [
+    {"since": -1}, {"since": "abc"}, {"since": 2 ** 63}, {"page_size": 0}, {"wait": 3600},
+])
+def test__book_changes__fail(client, params):
+    response = client.get(reverse("book-changes"), params)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert list(response.json()) == list(params)
+
+
+def create_book_later(book, delay=0.2):
+    def create():
+        create_book(**book)
+        connection.close()
+
+    timer = threading.Timer(delay, create)
+    timer.start()
+    return timer
+
+
+def test__book_changes__long_poll(client, book):
+    since = client.get(reverse("book-changes")).json()["cursor"]
+
+    started = time.monotonic()
+    assert client.get(reverse("book-changes"), {"since": since, "wait": 0.1}).json()["changes"] == []
+    assert time.monotonic() - started >= 0.1
+
+    timer = create_book_later(book)
+    response = client.get(reverse("book-changes"), {"since": since, "wait": 10}).json()
+    timer.join()
+    assert [item["book"]["title"] for item in response["changes"]] == [book["title"]]
+    assert time.monotonic() - started < 10
+
+
+def test__book_changes__long_poll_async(book):
+    factory = AsyncRequestFactory()
+    view = long_poll(offload(BookChanges.as_view(blocking=False)))
+    assert asyncio.iscoroutinefunction(view)
+
+    timer = create_book_later(book)
+    started = time.monotonic()
+    response = async_to_sync(view)(factory.get("/books/changes/?wait=10"))
+    timer.join()
+    assert [item["book"]["title"] for item in json.loads(response.content)["changes"]] == [book["title"]]
+    assert time.monotonic() - started < 10
+
+
+def test__book_batch__success(client, book, django_assert_num_queries):
+    first, second, third = (create_book(book["author"], f"Книга {i}") for i in range(3))
+
+    with django_assert_num_queries(1):
+        response = client.get(reverse("book-list"), {"ids": f"{third.id},{first.id},999,{third.id}"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "results": BookSerializer([third, first], many=True).data,
+        "missing": [999],
+    }
+
+    # Books already cached are not fetched again
+    with django_assert_num_queries(1) as queries:
+        response = client.get(reverse("book-list"), {"ids": f"{first.id},{second.id}", "fields": "id,title"})
+    assert f"IN ({second.id})" in queries.captured_queries[0]["sql"]
+    assert response.json()["results"] == [{"id": first.id, "title": "Книга 0"}, {"id": second.id, "title": "Книга 1"}]
+    etag = response["ETag"]
+
+    with django_assert_num_queries(0):
+        response = client.get(reverse("book-list"), {"ids": f"{second.id},{first.id}"})
+    assert [item["id"] for item in response.json()["results"]] == [second.id, first.id]
+
+    # A write moves the catalog version, and with it every cached book
+    client.patch(reverse("book-detail", args=[first.id]), {"title": "Белая гвардия"}, content_type="application/json")
+    params = {"ids": f"{first.id},{second.id}", "fields": "id,title"}
+    response = client.get(reverse("book-list"), params)
+    assert response.json()["results"][0]["title"] == "Белая гвардия"
+    assert response["ETag"] != etag
+    response = client.get(reverse("book-list"), params, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@override_settings(BOOKS_BATCH_MAX_IDS=2)
+@pytest.mark.parametrize("ids, error", [
+    ("", "Ожидался список id через запятую."),
+    ("1,abc", "Ожидался список id через запятую."),
+    ("1,0", "Ожидался список id через запятую."),
+    (f"1,{2 ** 63}", "Ожидался список id через запятую."),
+    ("1,2,3", "Не более 2 id за запрос."),
+])
+def test__book_batch__fail(client, ids, error):
+    response = client.get(reverse("book-list"), {"ids": ids})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"ids": [error]}
@@ -1,224 +1,790 @@
-from unittest.mock import patch
-
-import pytest
-from django.test import override_settings
-from django.urls import reverse
-from rest_framework import status
-
-from core.models import User
-
-# To use db
-pytestmark = pytest.mark.django_db(transaction=True)
-
-
-def test__user_registration__success(client, user_data):
-    user_data["password_confirm"] = user_data["password"]
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-    user_data.pop("password")
-    user_data.pop("password_confirm")
-    assert response.json() == user_data
-
-
-def test__user_registration__invalid_fields__fail(client, user_data):
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["password"] == ["Пароли не совпадают."]
-
-    user_data["password"] = "123"
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["password"] == ["Пароль должен содержать от 8 символов, 1 заглавную букву, 1 число."]
-
-    response = client.post(reverse("registration"), {}, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    for field in ["full_name", "email", "password"]:
-        assert response.json()[field] == ["Это поле обязательно."]
-
-    response = client.post(reverse("registration"), {"email": "sldhkasjd"}, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["email"] == ["Введите корректный email"]
-
-
-def test__user_registration__already_exist__fail(client, user_data):
-    user_data["password_confirm"] = user_data["password"]
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["email"] == ["Данный email уже зарегистрирован."]
-
-
-@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
-@patch("django.core.mail.send_mail")
-@patch("redis.Redis.set")
-def test__email_send_code__success(redis_set, send_mail, client, user_data):
-    user_data["password_confirm"] = user_data["password"]
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-
-    assert send_mail.called
-    assert send_mail.call_count == 1
-    assert send_mail.call_args[0][3][0] == user_data["email"]
-
-    assert redis_set.called
-    assert redis_set.call_count == 1
-    assert redis_set.call_args[0][0] == user_data["email"]
-    assert redis_set.call_args[0][1] in send_mail.call_args[0][1]
-    assert redis_set.call_args[1]["ex"] == 60 * 60 * 24
-
-
-@patch("redis.Redis.get")
-def test__email_confirm__success(redis_get, api_client, user_data):
-    code = 800555
-
-    redis_get.return_value = str(code).encode("utf-8")
-
-    user = User.objects.get(id=1)
-    assert not user.email_confirmed
-
-    response = api_client.patch(reverse("email-confirm"), {"code": code}, format="json")
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()["message"] == f"{user_data['email']} подтвержден."
-
-    user.refresh_from_db()
-    assert user.email_confirmed
-
-    assert redis_get.called
-    assert redis_get.call_count == 1
-    assert redis_get.call_args[0][0] == user_data["email"]
-
-
-@patch("redis.Redis.get")
-def test__email_confirm__fail(redis_get, api_client, user_data):
-    code = 800555
-    invalid_code = 800666
-
-    redis_get.return_value = str(code).encode("utf-8")
-
-    user = User.objects.get(id=1)
-    assert not user.email_confirmed
-
-    response = api_client.patch(reverse("email-confirm"), {"code": invalid_code}, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["code"][0] == "Неверный код"
-
-    user.refresh_from_db()
-    assert not user.email_confirmed
-
-    assert redis_get.called
-    assert redis_get.call_count == 1
-    assert redis_get.call_args[0][0] == user_data["email"]
-
-
-def test__get_profile__success(api_client, user_data):
-    response = api_client.get(reverse("profile"))
-    user_data.pop("password")
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json() == user_data
-
-
-def test__update_user_data__success(api_client):
-    body = {
-        "full_name": "Николай",
-    }
-
-    response = api_client.patch(reverse("profile"), body, format="json")
-    assert response.status_code == status.HTTP_200_OK
-
-    assert response.json()["full_name"] == body["full_name"]
-
-    response = api_client.patch(reverse("profile"), {"phone": "+88005553535"}, format="json")
-    assert response.status_code == status.HTTP_200_OK
-
-
-def test__update_user_data__fail(client, api_client, user_data):
-    user_data["password_confirm"] = user_data["password"]
-    user_data["email"] = "nick@yandex.ru"
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-
-    user_data.pop("password")
-    user_data.pop("password_confirm")
-
-    response = api_client.patch(reverse("profile"), user_data, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["email"][0] == "Данный email уже зарегистрирован."
-
-
-def test__get_token__success(client, user_data):
-    user_data["password_confirm"] = user_data["password"]
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-
-    body = {
-        "email": user_data["email"],
-        "password": user_data["password"],
-    }
-    response = client.post(reverse("token-obtain-pair"), body, format="json")
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()["access"]
-    assert response.json()["refresh"]
-
-
-def test__get_token__fail(client, user_data):
-    user_data["password_confirm"] = user_data["password"]
-
-    response = client.post(reverse("registration"), user_data, format="json")
-    assert response.status_code == status.HTTP_201_CREATED
-
-    body = {
-        "email": user_data["email"],
-        "password": user_data["password"] + "1",
-    }
-    response = client.post(reverse("token-obtain-pair"), body, format="json")
-    assert response.status_code == status.HTTP_401_UNAUTHORIZED
-    assert response.json()["detail"] == "No active account found with the given credentials"
-
-
-def test__change_user_password__success(api_client, user_data):
-    body = {
-        "password": user_data["password"],
-        "new_password": user_data["password"] + "1",
-        "new_password_confirm": user_data["password"] + "1",
-    }
-
-    response = api_client.patch(reverse("change-password"), body, format="json")
-    assert response.status_code == status.HTTP_200_OK
-
-    body = {
-        "email": user_data["email"],
-        "password": body["new_password"],
-    }
-    response = api_client.post(reverse("token-obtain-pair"), body, format="json")
-    assert response.status_code == status.HTTP_200_OK
-    assert response.json()["access"]
-    assert response.json()["refresh"]
-
-
-def test__change_user_password__fail(api_client, user_data):
-    body = {
-        "password": user_data["password"] + "1",
-        "new_password": user_data["password"],
-        "new_password_confirm": user_data["password"],
-    }
-
-    response = api_client.patch(reverse("change-password"), body, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["password"][0] == "Неверный старый пароль"
-
-    body = {
-        "password": user_data["password"],
-        "new_password": user_data["password"] + "1",
-        "new_password_confirm": user_data["password"],
-    }
-
-    response = api_client.patch(reverse("change-password"), body, format="json")
-    assert response.status_code == status.HTTP_400_BAD_REQUEST
-    assert response.json()["message"][0] == "Новые пароли не совпадают"
+import io
+import json
+import os
+import pstats
+import smtplib
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+import pytest
+import redis
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from kombu.exceptions import OperationalError
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core import metrics, profiling
+from core.codes import get_code_store
+from core.models import OutboxMessage, User
+from core.outbox import dispatch_pending, enqueue, purge_processed
+from core.redis_client import get_redis
+from core.tasks import deliver_confirmations, flush_confirmation_emails, parse_pending, send_email_with_confirm
+from core.throttling import LocalRateLimiter, get_rate_limiter
+from core.user_cache import FIELDS, cache_key, get_cache, local_cache
+
+# To use db
+pytestmark = pytest.mark.django_db(transaction=True, databases="__all__")
+
+
+def test__user_registration__success(client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    user_data.pop("password")
+    user_data.pop("password_confirm")
+    assert response.json() == user_data
+
+
+def test__user_registration__invalid_fields__fail(client, user_data):
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["password"] == ["Пароли не совпадают."]
+
+    user_data["password"] = "123"
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["password"] == ["Пароль должен содержать от 8 символов, 1 заглавную букву, 1 число."]
+
+    response = client.post(reverse("registration"), {}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    for field in ["full_name", "email", "password"]:
+        assert response.json()[field] == ["Это поле обязательно."]
+
+    response = client.post(reverse("registration"), {"email": "sldhkasjd"}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["email"] == ["Введите корректный email"]
+
+
+def test__user_registration__already_exist__fail(client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["email"] == ["Данный email уже зарегистрирован."]
+
+    # Stored with the domain lowercased, so checked that way too
+    response = client.post(reverse("registration"), {**user_data, "email": "nick@GMAIL.com"}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["email"] == ["Данный email уже зарегистрирован."]
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+def test__email_send_code__success(client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert not get_code_store().pending
+
+    call_command("dispatch_outbox", once=True, stdout=io.StringIO())
+    assert [parse_pending(entry)[0] for entry in get_code_store().pending] == [user_data["email"]]
+    assert not mail.outbox
+    assert not OutboxMessage.objects.filter(processed_at__isnull=False).exists()
+
+    assert flush_confirmation_emails() == {}
+    assert not get_code_store().pending
+    assert not OutboxMessage.objects.filter(processed_at__isnull=True).exists()
+
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].to == [user_data["email"]]
+
+    code, expires = get_code_store().codes[user_data["email"]]
+    assert code in mail.outbox[0].body
+    assert expires - time.monotonic() == pytest.approx(60 * 60 * 24, abs=5)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CONFIRM_EMAIL_BATCH_SIZE=2)
+@patch("core.tasks.flush_confirmation_emails.run")
+def test__email_send_code__flush_on_full_batch(flush, user_data):
+    send_email_with_confirm.delay(user_data["email"])
+    assert not flush.called
+
+    send_email_with_confirm.delay("nick@yandex.ru")
+    assert flush.called
+
+
+def test__email_deliver_confirmations__per_message_failure():
+    def send_messages(messages):
+        # The code is usable by the time the email is out
+        assert messages[0].to[0] in get_code_store().codes
+        if messages[0].to == ["bad@gmail.com"]:
+            raise smtplib.SMTPRecipientsRefused({"bad@gmail.com": (550, b"No such user")})
+        return 1
+
+    with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=send_messages) as send:
+        failed = deliver_confirmations(["first@gmail.com", "bad@gmail.com", "second@gmail.com"])
+
+    assert send.call_count == 3
+    assert list(failed) == ["bad@gmail.com"]
+    assert sorted(get_code_store().codes) == ["first@gmail.com", "second@gmail.com"]
+
+
+def test__email_confirm__success(api_client, user_data):
+    code = 800555
+
+    get_code_store().set_many({user_data["email"]: str(code)})
+
+    user = User.objects.get(id=1)
+    assert not user.email_confirmed
+
+    response = api_client.patch(reverse("email-confirm"), {"code": code}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["message"] == f"{user_data['email']} подтвержден."
+
+    user.refresh_from_db()
+    assert user.email_confirmed
+
+    # The code is consumed on use
+    response = api_client.patch(reverse("email-confirm"), {"code": code}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test__email_confirm__fail(api_client, user_data):
+    code = 800555
+    invalid_code = 800666
+
+    get_code_store().set_many({user_data["email"]: str(code)})
+
+    user = User.objects.get(id=1)
+    assert not user.email_confirmed
+
+    response = api_client.patch(reverse("email-confirm"), {"code": invalid_code}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["code"][0] == "Неверный код"
+
+    user.refresh_from_db()
+    assert not user.email_confirmed
+
+    # A wrong guess does not burn the real code
+    response = api_client.patch(reverse("email-confirm"), {"code": code}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test__email_confirm__no_code__fail(api_client):
+    response = api_client.patch(reverse("email-confirm"), {"code": 800555}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["code"][0] == "Неверный код"
+
+
+def test__get_profile__success(api_client, user_data):
+    response = api_client.get(reverse("profile"))
+    user_data.pop("password")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == user_data
+
+
+def test__update_user_data__success(api_client):
+    body = {
+        "full_name": "Николай",
+    }
+
+    response = api_client.patch(reverse("profile"), body, format="json")
+    assert response.status_code == status.HTTP_200_OK
+
+    assert response.json()["full_name"] == body["full_name"]
+
+    response = api_client.patch(reverse("profile"), {"phone": "+88005553535"}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test__update_user_data__fail(client, api_client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+    user_data["email"] = "nick@yandex.ru"
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    user_data.pop("password")
+    user_data.pop("password_confirm")
+
+    response = api_client.patch(reverse("profile"), user_data, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["email"][0] == "Данный email уже зарегистрирован."
+
+
+def test__get_token__success(client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    body = {
+        "email": user_data["email"],
+        "password": user_data["password"],
+    }
+    response = client.post(reverse("token-obtain-pair"), body, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["access"]
+    assert response.json()["refresh"]
+
+
+def test__get_token__fail(client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    body = {
+        "email": user_data["email"],
+        "password": user_data["password"] + "1",
+    }
+    response = client.post(reverse("token-obtain-pair"), body, format="json")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["detail"] == "No active account found with the given credentials"
+
+
+def test__change_user_password__success(api_client, user_data):
+    body = {
+        "password": user_data["password"],
+        "new_password": user_data["password"] + "1",
+        "new_password_confirm": user_data["password"] + "1",
+    }
+
+    response = api_client.patch(reverse("change-password"), body, format="json")
+    assert response.status_code == status.HTTP_200_OK
+
+    body = {
+        "email": user_data["email"],
+        "password": body["new_password"],
+    }
+    response = api_client.post(reverse("token-obtain-pair"), body, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["access"]
+    assert response.json()["refresh"]
+
+
+def test__change_user_password__fail(api_client, user_data):
+    body = {
+        "password": user_data["password"] + "1",
+        "new_password": user_data["password"],
+        "new_password_confirm": user_data["password"],
+    }
+
+    response = api_client.patch(reverse("change-password"), body, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["password"][0] == "Неверный старый пароль"
+
+    body = {
+        "password": user_data["password"],
+        "new_password": user_data["password"] + "1",
+        "new_password_confirm": user_data["password"],
+    }
+
+    response = api_client.patch(reverse("change-password"), body, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["message"][0] == "Новые пароли не совпадают"
+
+
+def test__jwt_user_cache__success(client, user_data, django_assert_num_queries):
+    user = User.objects.create(**user_data)
+    token = AccessToken.for_user(user)
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    response = client.get(reverse("profile"), **auth)
+    assert response.status_code == status.HTTP_200_OK
+
+    with django_assert_num_queries(0):
+        response = client.get(reverse("profile"), **auth)
+    assert response.json()["email"] == user_data["email"]
+
+    response = client.patch(reverse("profile"), {"full_name": "Николай"}, content_type="application/json", **auth)
+    assert response.status_code == status.HTTP_200_OK
+    assert client.get(reverse("profile"), **auth).json()["full_name"] == "Николай"
+
+    user.refresh_from_db()
+    user.is_active = False
+    user.save()
+    response = client.get(reverse("profile"), **auth)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test__jwt_user_cache__entry(client, user_data):
+    user = User.objects.create_user(**user_data)
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+    key = cache_key(user.id)
+
+    assert client.get(reverse("profile"), **auth).status_code == status.HTTP_200_OK
+    assert user.password not in get_cache().get(key)
+
+    # Dropped once the write is committed, not before
+    with transaction.atomic():
+        User.objects.get(id=user.id).save()
+        assert local_cache.get(key) is not None
+    assert local_cache.get(key) is None
+    assert get_cache().get(key) is None
+
+    # An entry cached before the user was deactivated
+    assert client.get(reverse("profile"), **auth).status_code == status.HTTP_200_OK
+    values = dict(zip(FIELDS, local_cache.get(key)), is_active=False)
+    local_cache.set(key, tuple(values.values()))
+    response = client.get(reverse("profile"), **auth)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["code"] == "user_inactive"
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1"])
+def test__jwt_user_cache__reads_primary(client, user_data):
+    user = User.objects.create_user(**user_data)
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+    # A replica would be chosen for the profile GET; the user row must not come from it
+    with patch("core.routers.ReplicaRouter.db_for_read", return_value="replica_1"):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            assert client.get(reverse("profile"), **auth).status_code == status.HTTP_200_OK
+    assert any('FROM "user"' in query["sql"] for query in queries)
+    assert local_cache.get(cache_key(user.id)) is not None
+
+
+@patch("core.tasks.send_email_with_confirm.apply_async")
+def test__user_registration__single_transaction(apply_async, client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.post(reverse("registration"), user_data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert not apply_async.called
+
+    writes = [query["sql"] for query in queries if not query["sql"].startswith("SELECT")]
+    assert writes[0] == "BEGIN"
+    assert writes[1].startswith('INSERT INTO "user"')
+    assert writes[2].startswith('INSERT INTO "core_outboxmessage"')
+    assert len(writes) == 3
+    assert user_data["password"] not in writes[1]
+
+    user = User.objects.get(email=user_data["email"])
+    assert user.check_password(user_data["password"])
+    message = OutboxMessage.objects.get()
+    assert message.args == [user_data["email"]]
+
+
+@patch("core.serializers.enqueue", side_effect=DatabaseError)
+def test__user_registration__outbox_rollback(enqueue, client, user_data):
+    user_data["password_confirm"] = user_data["password"]
+
+    with pytest.raises(DatabaseError):
+        client.post(reverse("registration"), user_data, format="json")
+    assert not User.objects.exists()
+
+
+@patch("core.tasks.send_email_with_confirm.apply_async")
+def test__dispatch_outbox__batches(apply_async, settings):
+    for i in range(5):
+        enqueue(send_email_with_confirm, f"user{i}@gmail.com")
+
+    assert dispatch_pending(batch_size=3) == 3
+    assert dispatch_pending(batch_size=3) == 2
+    assert dispatch_pending(batch_size=3) == 0
+    ids = OutboxMessage.objects.order_by("id").values_list("id", flat=True)
+    assert [call.args for call in apply_async.call_args_list] == [
+        ([f"user{i}@gmail.com"], {"outbox_id": outbox_id}) for i, outbox_id in enumerate(ids)
+    ]
+
+    # Never processed by a worker, so published again once stale
+    settings.OUTBOX_REDELIVER_AFTER = 0
+    assert dispatch_pending() == 5
+
+
+@patch("core.tasks.send_email_with_confirm.apply_async", side_effect=OperationalError)
+def test__dispatch_outbox__broker_down(apply_async, user_data):
+    enqueue(send_email_with_confirm, user_data["email"])
+
+    assert dispatch_pending() == 0
+    assert OutboxMessage.objects.get().dispatched_at is None
+
+
+def test__dispatch_outbox__attempts_cap(settings, user_data, caplog):
+    settings.OUTBOX_REDELIVER_AFTER = 0
+    settings.OUTBOX_MAX_ATTEMPTS = 2
+    enqueue(send_email_with_confirm, user_data["email"])
+
+    with patch("core.tasks.send_email_with_confirm.apply_async") as apply_async:
+        assert dispatch_pending() == 1
+        assert dispatch_pending() == 1
+        # Never processed after two attempts: set aside instead of published forever
+        assert dispatch_pending() == 0
+        assert dispatch_pending() == 0
+    assert apply_async.call_count == 2
+    message = OutboxMessage.objects.get()
+    assert message.attempts == 2
+    assert message.failed_at is not None
+    assert "not processed after 2 attempts" in caplog.text
+
+
+# As run by `DJANGO_FAST_BOOT=1 manage.py dispatch_outbox --skip-checks`, where nothing has imported core.tasks
+DISPATCHER = """
+import sys
+import django
+from django.conf import settings
+
+settings.DATABASES["default"]["NAME"] = sys.argv[1]
+settings.CELERY_BROKER_URL = "memory://"
+django.setup()
+
+from django.core.management import call_command
+from core.models import OutboxMessage
+
+call_command("migrate", verbosity=0)
+OutboxMessage.objects.create(task="core.tasks.send_email_with_confirm", args=["nick@gmail.com"])
+call_command("dispatch_outbox", once=True, skip_checks=True)
+assert OutboxMessage.objects.get().dispatched_at is not None
+"""
+
+
+def test__dispatch_outbox__fast_boot(tmp_path):
+    env = {
+        **os.environ, "DJANGO_SETTINGS_MODULE": "skillfactory.settings", "DJANGO_FAST_BOOT": "1",
+        "PYTHONPATH": str(settings.BASE_DIR),
+    }
+    result = subprocess.run(
+        [sys.executable, "-c", DISPATCHER, str(tmp_path / "db.sqlite3")],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "Published 1 messages" in result.stdout
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+def test__send_email_with_confirm__idempotent(user_data):
+    message = enqueue(send_email_with_confirm, user_data["email"])
+
+    send_email_with_confirm.delay(user_data["email"], outbox_id=message.id)
+    # Redelivered before the batch went out: the email is still sent once
+    send_email_with_confirm.delay(user_data["email"], outbox_id=message.id)
+    message.refresh_from_db()
+    assert message.processed_at is None
+
+    flush_confirmation_emails()
+    assert [item.to for item in mail.outbox] == [[user_data["email"]]]
+    message.refresh_from_db()
+    assert message.processed_at is not None
+
+    send_email_with_confirm.delay(user_data["email"], outbox_id=message.id)
+    assert not get_code_store().pending
+
+    message.processed_at -= timedelta(days=30)
+    message.save()
+    assert purge_processed() == 1
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+def test__send_email_with_confirm__processed_after_delivery(user_data):
+    failing = enqueue(send_email_with_confirm, "bad@gmail.com")
+    delivered = enqueue(send_email_with_confirm, user_data["email"])
+    send_email_with_confirm.delay("bad@gmail.com", outbox_id=failing.id)
+    send_email_with_confirm.delay(user_data["email"], outbox_id=delivered.id)
+
+    def send_messages(messages):
+        if messages[0].to == ["bad@gmail.com"]:
+            raise smtplib.SMTPServerDisconnected()
+        return 1
+
+    with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=send_messages):
+        assert list(flush_confirmation_emails()) == ["bad@gmail.com"]
+
+    # Left for the outbox to redeliver
+    assert OutboxMessage.objects.get(id=failing.id).processed_at is None
+    assert OutboxMessage.objects.get(id=delivered.id).processed_at is not None
+
+
+@override_settings(USER_PROVISION_WORKERS=2)
+def test__user_provision__success(admin_api_client, user_data):
+    users = [
+        {**user_data, "email": "first@gmail.com"},
+        {**user_data, "email": "second@gmail.com"},
+        {**user_data, "email": "second@gmail.com"},
+        {**user_data, "email": "admin@gmail.com"},
+        {**user_data, "email": "third@gmail.com", "password": "123"},
+    ]
+
+    response = admin_api_client.post(reverse("user-provision"), users, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["created"] == ["first@gmail.com", "second@gmail.com"]
+    assert response.json()["errors"] == {
+        "2": {"email": ["Повторяющийся email."]},
+        "3": {"email": ["Данный email уже зарегистрирован."]},
+        "4": {"password": ["Пароль должен содержать от 8 символов, 1 заглавную букву, 1 число."]},
+    }
+    assert User.objects.get(email="second@gmail.com").check_password(user_data["password"])
+    assert not OutboxMessage.objects.exists()
+
+
+@patch("celery_app.app.producer_or_acquire", side_effect=OperationalError)
+def test__user_provision__send_emails__broker_down(producer, admin_api_client, user_data):
+    users = [{**user_data, "email": "first@gmail.com"}, {**user_data, "email": "second@gmail.com"}]
+
+    # Nothing is published in the request, the outbox holds the emails until the broker is back
+    response = admin_api_client.post(f"{reverse('user-provision')}?send_emails=1", users, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [message.args for message in OutboxMessage.objects.order_by("id")] == [[user["email"]] for user in users]
+    assert not producer.called
+
+
+def test__user_provision__not_admin__fail(api_client, user_data):
+    response = api_client.post(reverse("user-provision"), [user_data], format="json")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+@patch("core.tasks.send_email_with_confirm.run")
+def test__provision_users_command__success(run, tmp_path, user_data):
+    path = tmp_path / "users.csv"
+    path.write_text(
+        "full_name,email,password\n"
+        f"{user_data['full_name']},{user_data['email']},{user_data['password']}\n"
+        f"{user_data['full_name']},broken,{user_data['password']}\n",
+        encoding="utf-8",
+    )
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command("provision_users", str(path), workers=1, send_emails=True, stdout=stdout, stderr=stderr)
+
+    assert "Created 1 users, 1 rows failed" in stdout.getvalue()
+    assert f"{path}:2:" in stderr.getvalue()
+    assert User.objects.get(email=user_data["email"]).check_password(user_data["password"])
+    assert not run.called
+
+    assert dispatch_pending() == 1
+    assert run.call_args[0][0] == user_data["email"]
+
+
+@patch("core.provisioning.ProcessPoolExecutor", side_effect=lambda max_workers, initializer: ThreadPoolExecutor(2))
+def test__provision_users_command__jsonl(executor, tmp_path, user_data):
+    path = tmp_path / "users.jsonl"
+    rows = [{**user_data, "email": f"user{i}@gmail.com"} for i in range(4)]
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+
+    call_command("provision_users", str(path), workers=2, batch_size=2, stdout=io.StringIO())
+    assert User.objects.count() == 4
+    # One pool for both batches
+    assert executor.call_count == 1
+
+    path.write_text(json.dumps(rows[0]) + "\n\n{broken\n", encoding="utf-8")
+    with pytest.raises(CommandError, match=f"{path}:3: "):
+        call_command("provision_users", str(path), workers=1, stdout=io.StringIO())
+
+
+def test__get_token__throttled(client, user_data, settings, django_assert_num_queries):
+    settings.RATE_LIMITS = {"token": "3/m"}
+    body = {"email": user_data["email"], "password": user_data["password"]}
+
+    for _ in range(3):
+        response = client.post(reverse("token-obtain-pair"), body, format="json")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    with django_assert_num_queries(0):
+        response = client.post(reverse("token-obtain-pair"), body, format="json")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response["Retry-After"]) > 0
+
+
+def test__user_registration__throttled_by_email(client, user_data, settings):
+    settings.RATE_LIMITS = {"registration": "2/m"}
+    user_data["password_confirm"] = user_data["password"] + "1"
+
+    for address in ["10.0.0.1", "10.0.0.2"]:
+        response = client.post(reverse("registration"), user_data, format="json", REMOTE_ADDR=address)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    user_data["email"] = user_data["email"].upper()
+    response = client.post(reverse("registration"), user_data, format="json", REMOTE_ADDR="10.0.0.3")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    user_data["email"] = "other@gmail.com"
+    response = client.post(reverse("registration"), user_data, format="json", REMOTE_ADDR="10.0.0.3")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test__user_registration__throttled_by_address(client, user_data, settings):
+    settings.RATE_LIMITS = {"registration": "2/m"}
+    user_data["password_confirm"] = user_data["password"] + "1"
+
+    def register(number, **headers):
+        body = {**user_data, "email": f"user{number}@gmail.com"}
+        return client.post(reverse("registration"), body, format="json", REMOTE_ADDR="10.0.0.1", **headers)
+
+    # A client-supplied X-Forwarded-For doesn't make a new client
+    assert register(1, HTTP_X_FORWARDED_FOR="1.1.1.1").status_code == status.HTTP_400_BAD_REQUEST
+    assert register(2, HTTP_X_FORWARDED_FOR="2.2.2.2").status_code == status.HTTP_400_BAD_REQUEST
+    assert register(3, HTTP_X_FORWARDED_FOR="3.3.3.3").status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    # Behind a load balancer, only the address it appended counts
+    settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+    assert register(4, HTTP_X_FORWARDED_FOR="4.4.4.4, 10.1.0.1").status_code == status.HTTP_400_BAD_REQUEST
+    assert register(5, HTTP_X_FORWARDED_FOR="5.5.5.5, 10.1.0.1").status_code == status.HTTP_400_BAD_REQUEST
+    assert register(6, HTTP_X_FORWARDED_FOR="6.6.6.6, 10.1.0.1").status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def test__change_user_password__throttled(api_client, user_data, settings):
+    settings.RATE_LIMITS = {"change-password": "1/m"}
+    body = {
+        "password": user_data["password"] + "1",
+        "new_password": user_data["password"],
+        "new_password_confirm": user_data["password"],
+    }
+
+    response = api_client.patch(reverse("change-password"), body, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = api_client.patch(reverse("change-password"), body, format="json")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def test__rate_limiter__refill():
+    limiter = LocalRateLimiter()
+
+    assert limiter.hit(["a", "b"], 2, 60, now=0) == (True, 0)
+    assert limiter.hit(["b"], 2, 60, now=0) == (True, 0)
+    assert limiter.hit(["a", "b"], 2, 60, now=0) == (False, 30)
+    # A rejected request does not take a token from the buckets that still had one
+    assert limiter.hit(["a"], 2, 60, now=0) == (True, 0)
+    assert limiter.hit(["a", "b"], 2, 60, now=30) == (True, 0)
+
+
+@override_settings(RATE_LIMITER="core.throttling.RedisRateLimiter")
+def test__rate_limiter__redis_unavailable():
+    limiter = get_rate_limiter()
+    limiter.hit_script = Mock(side_effect=redis.ConnectionError)
+
+    assert limiter.hit(["a"], 1, 60, now=0) == (True, 0)
+    assert limiter.hit(["a"], 1, 60, now=1) == (False, 59)
+    assert limiter.hit_script.call_count == 1
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0)
+def test__profiling__server_timing(client, user_data):
+    User.objects.create_user(**user_data)
+    token = AccessToken.for_user(User.objects.get(email=user_data["email"]))
+
+    response = client.get(reverse("profile"), HTTP_AUTHORIZATION=f"Bearer {token}")
+    assert response.status_code == status.HTTP_200_OK
+    timing = response["Server-Timing"]
+    assert timing.startswith("total;dur=")
+    assert 'desc="1 queries, 0 duplicates"' in timing
+    assert "serializer;dur=" in timing
+
+    response = client.get(reverse("profile"), HTTP_AUTHORIZATION=f"Bearer {token}")
+    assert 'desc="0 queries, 0 duplicates"' in response["Server-Timing"]
+
+
+def test__profiling__disabled(client):
+    response = client.get(reverse("profile"))
+    assert "Server-Timing" not in response
+
+
+def test__profiling__repeated_queries(user_data):
+    profiling.install()
+    user = User.objects.create_user(**user_data)
+
+    profile = profiling.Profile()
+    token = profiling.current_profile.set(profile)
+    try:
+        for _ in range(3):
+            User.objects.get(id=user.id)
+        User.objects.get(email=user.email)
+    finally:
+        profiling.current_profile.reset(token)
+
+    assert profile.calls["db"] == 4
+    assert profile.duplicates == 2
+    assert list(profile.repeated.values()) == [3]
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1)
+def test__profiling__sampled_dump(client, settings, tmp_path):
+    settings.PROFILING_DIR = tmp_path
+
+    response = client.get(reverse("profile"))
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    [path] = tmp_path.iterdir()
+    assert "-profile-GET-" in path.name
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+def test__metrics__requests_by_url_name(client, user_data):
+    client.get(reverse("profile"))
+    client.get(reverse("book-detail", args=[404]))
+    client.get("/no/such/page/")
+
+    response = client.get(reverse("metrics"))
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    body = response.content.decode()
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_request_duration_seconds_count{view="profile",method="GET",status="401"}' in body
+    assert 'http_request_duration_seconds_bucket{view="book-detail",method="GET",status="404",le="+Inf"}' in body
+    assert 'view="unresolved"' in body
+    assert 'db_queries_total{alias="default"}' in body
+
+
+def test__metrics__token(client, settings):
+    settings.METRICS_TOKEN = "secret"
+    assert client.get(reverse("metrics")).status_code == status.HTTP_401_UNAUTHORIZED
+    assert client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret").status_code == status.HTTP_200_OK
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+@patch("core.tasks.deliver_confirmations", side_effect=smtplib.SMTPException)
+def test__metrics__celery_tasks(deliver, settings, user_data):
+    settings.CONFIRM_EMAIL_BATCH_SIZE = 1
+    failures = metrics.task_failures.collect()[("core.tasks.flush_confirmation_emails",)]
+
+    send_email_with_confirm.delay(user_data["email"])
+
+    assert metrics.task_failures.collect()[("core.tasks.flush_confirmation_emails",)] == failures + 1
+    assert metrics.task_duration.collect()[("core.tasks.send_email_with_confirm", "SUCCESS")][-1] > 0
+
+
+def test__metrics__processes_aggregated(settings, tmp_path):
+    settings.METRICS_DIR = str(tmp_path)
+    registry = metrics.Registry()
+    histogram = registry.histogram("test_seconds", "Test.", ["view"], buckets=(0.1, 1))
+    counter = registry.counter("test_total", "Test.")
+
+    histogram.observe(0.05, "book-list")
+    counter.inc()
+    registry.flush()
+    # Another worker's snapshot
+    (tmp_path / "1-other.json").write_text(json.dumps({
+        "test_seconds": [[["book-list"], [0, 2, 1, 7.5]]],
+        "test_total": [[[], 3]],
+    }))
+    histogram.observe(0.5, "book-list")
+
+    body = registry.exposition()
+    assert 'test_seconds_bucket{view="book-list",le="0.1"} 1\n' in body
+    assert 'test_seconds_bucket{view="book-list",le="1"} 4\n' in body
+    assert 'test_seconds_bucket{view="book-list",le="+Inf"} 5\n' in body
+    assert 'test_seconds_count{view="book-list"} 5\n' in body
+    assert "test_total 4.0\n" in body
+
+
+def test__metrics__redis_commands(settings):
+    settings.CACHES = {"default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": "redis://localhost:1/1"}}
+    settings.REDIS_PORT = 1
+
+    def pings():
+        return sum(metrics.redis_duration.collect()[("PING",)][:-1])
+
+    before = pings()
+    # Failed commands are timed as well
+    with pytest.raises(redis.ConnectionError):
+        get_redis(15).ping()
+    with pytest.raises(redis.ConnectionError):
+        caches["default"].client.get_client().ping()
+    assert pings() == before + 2